@@ -0,0 +1,420 @@
+#
+# Benchmarks for the drug design programs.
+#
+#  Four kinds of measurement, each optional:
+#    scoring:     ligands per second for each scorer, by ligand length and
+#                 protein length (runs in this one process)
+#    transport:   time to send a batch of ligands and get its scores back,
+#                 as pickled lists or as buffers (see --transport in
+#                 dd_mpi_dynamic.py), with messages this process sends itself
+#    simulation:  the schedulers of dd_mpi_dynamic.py and
+#                 dd_mpi_equal_chunks.py run on a simulated cluster, where
+#                 each ligand has a made-up cost that depends on its length,
+#                 so schedulers can be compared for any number of workers
+#    mpi:         real runs of the two programs with mpirun, for several
+#                 maximum ligand lengths
+#
+#  The results are written as JSON with --json, and a saved file can be
+#  compared with the current results with --compare.
+#
+#  python dd_benchmark.py --json before.json
+#  (change something)
+#  python dd_benchmark.py --json after.json --compare before.json
+#
+
+import argparse
+import heapq
+import json
+import math
+import os
+import platform
+import re
+import shlex
+import subprocess
+import sys
+import time
+
+import numpy as np
+from mpi4py import MPI
+
+from dd_functions import *
+
+DFLT_ligandLengths = [2, 3, 4, 5, 6, 7]
+DFLT_proteinLengths = [20, 40, 80]
+DFLT_minTime = 0.2
+DFLT_batchSizes = [1, 10, 100, 1000, 10000]
+DFLT_workers = [4, 16, 64]
+DFLT_simLigands = 20000
+DFLT_taskTime = 1e-3
+DFLT_latency = 5e-5
+DFLT_mpiLigands = 2000
+DFLT_mpiMaxLigand = [3, 5, 7]
+DFLT_mpirun = "mpirun"
+
+# ligand length distributions: each returns nLigands lengths from 2 to maxLigand
+DISTRIBUTIONS = {
+    # the distribution used to make random ligands (see dd_ligands.py)
+    "gamma": lambda rng, n, maxLigand:
+        np.clip(rng.gamma(4.2, 0.8, size=n).astype(np.int64), 2, maxLigand),
+    "uniform": lambda rng, n, maxLigand:
+        rng.integers(2, maxLigand + 1, size=n),
+    # mostly very short ligands with a few of the longest length
+    "bimodal": lambda rng, n, maxLigand:
+        np.where(rng.random(n) < 0.9, 2, maxLigand),
+}
+
+def getBenchmarkArgs():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for the CSinParallel Drug Design simulation")
+    parser.add_argument('--skip', nargs='+', default=[],
+        choices=['scoring', 'transport', 'simulation', 'mpi'],
+        help='benchmarks not to run (mpi is only run with --mpi-np)')
+    parser.add_argument('--scorers', nargs='+', choices=sorted(SCORERS),
+        default=sorted(SCORERS), help='scorers to time')
+    parser.add_argument('--ligand-lengths', dest='ligandLengths', type=int,
+        nargs='+', default=DFLT_ligandLengths, help='ligand lengths to time')
+    parser.add_argument('--protein-lengths', dest='proteinLengths', type=int,
+        nargs='+', default=DFLT_proteinLengths, help='protein lengths to time')
+    parser.add_argument('--min-time', dest='minTime', type=float,
+        default=DFLT_minTime,
+        help='seconds to spend timing each scorer, ligand and protein length')
+    parser.add_argument('--batch-sizes', dest='batchSizes', type=int,
+        nargs='+', default=DFLT_batchSizes,
+        help='numbers of ligands per message to time the transports with')
+    parser.add_argument('--workers', type=int, nargs='+', default=DFLT_workers,
+        help='numbers of simulated workers')
+    parser.add_argument('--sim-ligands', dest='simLigands', type=int,
+        default=DFLT_simLigands, help='number of simulated ligands')
+    parser.add_argument('--maxLigand', metavar='max-length', type=int,
+        default=DFLT_maxLigand, help='maximum length of a simulated ligand')
+    parser.add_argument('--cost-model', dest='costModel', choices=sorted(SCORERS),
+        default="recursive",
+        help='scorer whose estimated cost is given to each simulated ligand')
+    parser.add_argument('--task-time', dest='taskTime', type=float,
+        default=DFLT_taskTime, help='mean seconds to score a simulated ligand')
+    parser.add_argument('--latency', type=float, default=DFLT_latency,
+        help='seconds the simulated master spends on each message')
+    parser.add_argument('--mpi-np', dest='mpiNp', type=int, nargs='+',
+        default=[], help='numbers of processes for real mpirun runs')
+    parser.add_argument('--mpi-ligands', dest='mpiLigands', type=int,
+        default=DFLT_mpiLigands, help='number of ligands in each real run')
+    parser.add_argument('--mpi-maxLigand', dest='mpiMaxLigand', type=int,
+        nargs='+', default=DFLT_mpiMaxLigand,
+        help='maximum ligand lengths for the real runs')
+    parser.add_argument('--mpirun', default=DFLT_mpirun,
+        help='command used to start the real runs, e.g. "mpirun --oversubscribe"')
+    parser.add_argument('--seed', type=int, default=DFLT_seed,
+        help='seed for the random ligands and proteins')
+    parser.add_argument('--json', metavar='file', default=None,
+        help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='file', default=None,
+        help='JSON results of an earlier run to compare with')
+    return parser.parse_args()
+
+# function randomStrings
+#   4 arguments:  a numpy random Generator, number of strings, their length
+#                 and the letters to draw from
+#   return:  list of random strings
+
+def randomStrings(rng, n, length, alphabet="abcdefghijklmnopqrstuvwxyz"):
+    letters = np.frombuffer(alphabet.encode(), dtype=np.uint8)
+    chosen = letters[rng.integers(0, len(letters), size=(n, length))]
+    return chosen.view("S{}".format(length)).ravel().astype(str).tolist()
+
+# function timeScorer
+#   4 arguments:  a scorer name, list of ligands, a protein and the least
+#                 number of seconds to spend
+#   return:  ligands scored per second
+#
+# The start of the list is scored repeatedly until minTime has passed,
+# doubling the number of ligands scored each time up to the whole list, so
+# a slow scorer is not stuck on a long list.
+
+def timeScorer(scorerName, ligands, pro, minTime):
+    scored = 0
+    n = 1
+    start = time.perf_counter()
+    while True:
+        scoreLigands(ligands[:n], pro, scorerName)
+        scored += n
+        elapsed = time.perf_counter() - start
+        if elapsed >= minTime:
+            return scored / elapsed
+        n = min(2 * n, len(ligands))
+
+# function benchScoring
+#   1 argument:  the command line arguments
+#   return:  list of results, one per scorer, ligand length and protein length
+
+def benchScoring(args):
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for proLength in args.proteinLengths:
+        pro = randomStrings(rng, 1, proLength)[0]
+        for ligLength in args.ligandLengths:
+            ligands = randomStrings(rng, 256, ligLength)
+            for scorerName in args.scorers:
+                if scorerName == "recursive" and \
+                   math.comb(ligLength + proLength, ligLength) > 1e6:
+                    continue    # far too slow to time
+                rate = timeScorer(scorerName, ligands, pro, args.minTime)
+                results.append({"scorer": scorerName, "ligandLength": ligLength,
+                    "proteinLength": proLength, "ligandsPerSec": rate})
+                print("score   {:12s} ligand {:2d} protein {:3d}: {:12.0f} ligands/sec"\
+                .format(scorerName, ligLength, proLength, rate), flush=True)
+    return results
+
+# function roundTrip
+#   3 arguments:  a communicator of one process, a transport name and a
+#                 list of ligands
+#   state change:  sends the ligands to this same process and a score for
+#                  each back, the way dd_mpi_dynamic.py does
+#
+# The scores are made up, so only the cost of the messages is timed.
+
+def roundTrip(comm, transport, ligands):
+    if transport == "buffer":
+        message = packBatch(-1, ligands)
+        request = comm.Isend([message, MPI.BYTE], dest=0, tag=1)
+        received = np.empty(len(message), dtype=np.uint8)
+        comm.Recv([received, MPI.BYTE], source=0, tag=1)
+        request.Wait()
+        threshold, ligs = unpackBatch(received)
+        scores = np.zeros(1 + len(ligs), dtype=np.int32)
+        request = comm.Isend([scores, MPI.INT], dest=0, tag=2)
+        results = np.empty(1 + len(ligs), dtype=np.int32)
+        comm.Recv([results, MPI.INT], source=0, tag=2)
+        request.Wait()
+        results[1:].tolist()
+    else:
+        request = comm.isend([-1, ligands], dest=0, tag=1)
+        threshold, ligs = comm.recv(source=0, tag=1)
+        request.wait()
+        request = comm.isend([-1, [0] * len(ligs)], dest=0, tag=2)
+        comm.recv(source=0, tag=2)
+        request.wait()
+
+# function benchTransport
+#   1 argument:  the command line arguments
+#   return:  list of results, one per transport and batch size
+
+def benchTransport(args):
+    source = RandomLigands(max(args.batchSizes), args.maxLigand, args.seed)
+    results = []
+    for batchSize in args.batchSizes:
+        ligands = source.getRange(0, batchSize)
+        for transport in ["pickle", "buffer"]:
+            trips = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < args.minTime:
+                roundTrip(MPI.COMM_SELF, transport, ligands)
+                trips += 1
+            perTrip = (time.perf_counter() - start) / trips
+            results.append({"transport": transport, "batchSize": batchSize,
+                            "secondsPerMessage": perTrip})
+            print("transport {:6s} {:6d} ligands per message: {:10.1f} usec"\
+            .format(transport, batchSize, perTrip * 1e6), flush=True)
+    return results
+
+# function simulateStatic
+#   3 arguments:  array of task costs, list of index lists (one per worker,
+#                 as from partitionLigands) and message latency
+#   return:  time until the last worker finishes
+#
+# The master sends one message to each worker in turn, then each worker
+# scores its whole part.
+
+def simulateStatic(costs, parts, latency):
+    return max((w + 1) * latency + costs[part].sum()
+               for w, part in enumerate(parts))
+
+# function simulateDynamic
+#   5 arguments:  array of task costs in the order they are handed out,
+#                 number of workers, schedule ('single' or 'guided'),
+#                 smallest guided batch and message latency
+#   optional argument:  whether guided batches are sized by their share of
+#                       the remaining cost, as dd_mpi_dynamic.py does with
+#                       --sort-by-cost
+#   return:  time until the last worker finishes and the number of work
+#            messages the master sent
+#
+# The master handles one message at a time, taking latency seconds for
+# each; a worker asks for more work as soon as it finishes a batch.
+
+def simulateDynamic(costs, numWorkers, schedule, minChunk, latency,
+                    byCost=False):
+    ready = [(0.0, w) for w in range(numWorkers)]   # heap of (time, worker)
+    masterFree = 0.0
+    finish = 0.0
+    messages = 0
+    handedOut = 0
+    total = np.concatenate(([0.0], np.cumsum(costs)))
+    while handedOut < len(costs):
+        asked, w = heapq.heappop(ready)
+        if schedule == 'guided' and byCost:
+            size = int(guidedCostChunkSize(total, handedOut, numWorkers, minChunk))
+        elif schedule == 'guided':
+            size = guidedChunkSize(len(costs) - handedOut, numWorkers, minChunk)
+        else:
+            size = 1
+        size = min(size, len(costs) - handedOut)
+        sent = max(asked, masterFree) + latency
+        masterFree = sent
+        messages += 1
+        done = sent + total[handedOut + size] - total[handedOut]
+        handedOut += size
+        finish = max(finish, done)
+        heapq.heappush(ready, (done + latency, w))
+    return finish, messages
+
+# function benchSimulation
+#   1 argument:  the command line arguments
+#   return:  list of results, one per distribution, number of workers and
+#            scheduler
+
+def benchSimulation(args):
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for distName in sorted(DISTRIBUTIONS):
+        lengths = DISTRIBUTIONS[distName](rng, args.simLigands, args.maxLigand)
+        # stand-in ligands of the right lengths, for the cost estimates
+        ligands = ["a" * int(n) for n in lengths]
+        costs = np.array([estimateCost(lig, DFLT_protein, args.costModel)
+                          for lig in ligands], dtype=np.float64)
+        costs *= args.taskTime / costs.mean()
+        byCost = np.argsort(-costs, kind='stable')
+        for numWorkers in args.workers:
+            ideal = costs.sum() / numWorkers
+            runs = []
+            for method in ["block", "strided", "lpt"]:
+                parts = partitionLigands(ligands, numWorkers, DFLT_protein,
+                                         args.costModel, method)
+                parts = [np.array(part, dtype=np.int64) for part in parts]
+                runs.append(("equal-chunks " + method,
+                    simulateStatic(costs, parts, args.latency), numWorkers))
+            for schedule in ["single", "guided"]:
+                for sortByCost in [False, True]:
+                    order = costs[byCost] if sortByCost else costs
+                    makespan, messages = simulateDynamic(order, numWorkers,
+                        schedule, 1, args.latency, sortByCost)
+                    name = "dynamic " + schedule + (" sorted" if sortByCost else "")
+                    runs.append((name, makespan, messages))
+            for name, makespan, messages in runs:
+                results.append({"distribution": distName, "workers": numWorkers,
+                    "scheduler": name, "makespan": makespan,
+                    "efficiency": ideal / makespan, "messages": messages})
+                print("simulate {:8s} {:4d} workers {:24s}: {:10.4f} sec, "
+                      "efficiency {:5.1%}, {} messages".format(distName,
+                      numWorkers, name, makespan, ideal / makespan, messages),
+                      flush=True)
+    return results
+
+# function runProgram
+#   4 arguments:  the command line arguments, the program file name, the
+#                 rest of its command line as a list and number of processes
+#   return:  the "Total Running time" it printed, or None if it failed
+
+def runProgram(args, program, programArgs, nProcesses):
+    command = shlex.split(args.mpirun) + ["-np", str(nProcesses), sys.executable,
+                                          program] + programArgs
+    # If MPI was started in this process, it set variables describing its
+    # one-process job in the C environment, and mpirun must not think its
+    # programs belong to that job.  os.environ still holds the environment
+    # this process was started with, including any MPI settings of the user.
+    env = dict(os.environ)
+    run = subprocess.run(command, capture_output=True, text=True, env=env)
+    found = re.search(r"Total Running time:\s*([0-9.]+)", run.stdout)
+    if run.returncode != 0 or found is None:
+        print("failed:", " ".join(command), file=sys.stderr)
+        print(run.stdout + run.stderr, file=sys.stderr)
+        return None
+    return float(found.group(1))
+
+# function benchMpi
+#   1 argument:  the command line arguments
+#   return:  list of results, one per maximum ligand length, number of
+#            processes and program configuration
+
+def benchMpi(args):
+    configurations = [
+        ("equal-chunks block", "dd_mpi_equal_chunks.py", []),
+        ("equal-chunks lpt", "dd_mpi_equal_chunks.py", ["--partition", "lpt"]),
+        ("dynamic single", "dd_mpi_dynamic.py", []),
+        ("dynamic single pickle", "dd_mpi_dynamic.py", ["--transport", "pickle"]),
+        ("dynamic guided", "dd_mpi_dynamic.py", ["--schedule", "guided"]),
+    ]
+    results = []
+    for maxLigand in args.mpiMaxLigand:
+        common = [str(args.mpiLigands), "--maxLigand", str(maxLigand),
+                  "--seed", str(args.seed),
+                  "--cache-size", "0"]
+        for nProcesses in args.mpiNp:
+            for name, program, extra in configurations:
+                seconds = runProgram(args, program, common + extra, nProcesses)
+                if seconds is None:
+                    continue
+                results.append({"maxLigand": maxLigand,
+                    "processes": nProcesses, "scheduler": name, "seconds": seconds})
+                print("mpi      maxLigand {:2d} {:4d} processes {:20s}: {:10.3f} sec"\
+                .format(maxLigand, nProcesses, name, seconds), flush=True)
+    return results
+
+# function resultKey
+#   2 arguments:  name of a benchmark and one of its results
+#   return:  string naming what was measured, the same between runs
+
+def resultKey(benchmark, result):
+    measured = {"ligandsPerSec", "secondsPerMessage", "makespan", "efficiency",
+                "messages", "seconds"}
+    return benchmark + " " + " ".join("{}={}".format(k, v)
+        for k, v in sorted(result.items()) if k not in measured)
+
+# what is compared for each benchmark, and whether bigger is better
+COMPARED = {"scoring": ("ligandsPerSec", True),
+            "transport": ("secondsPerMessage", False),
+            "simulation": ("makespan", False),
+            "mpi": ("seconds", False)}
+
+# function compareResults
+#   2 arguments:  the results of an earlier run and of this run
+#   state change:  prints each measurement of both runs with the change, and
+#                  marks the ones more than 10% worse
+
+def compareResults(old, new):
+    print("\nComparison with earlier results (ratio new/old):")
+    for benchmark, (value, biggerIsBetter) in COMPARED.items():
+        before = {resultKey(benchmark, r): r[value]
+                  for r in old.get(benchmark, [])}
+        for r in new.get(benchmark, []):
+            key = resultKey(benchmark, r)
+            if key not in before or before[key] == 0:
+                continue
+            ratio = r[value] / before[key]
+            worse = ratio < 0.9 if biggerIsBetter else ratio > 1.1
+            print("{:8.3f} {} {}".format(ratio, key, "  <-- worse" if worse else ""))
+
+def main():
+    args = getBenchmarkArgs()
+    results = {"info": {"python": platform.python_version(),
+                        "numpy": np.__version__,
+                        "machine": platform.node(),
+                        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "args": vars(args)}}
+    if "scoring" not in args.skip:
+        results["scoring"] = benchScoring(args)
+    if "transport" not in args.skip:
+        results["transport"] = benchTransport(args)
+    if "simulation" not in args.skip:
+        results["simulation"] = benchSimulation(args)
+    if "mpi" not in args.skip and args.mpiNp:
+        results["mpi"] = benchMpi(args)
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compareResults(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# Score cache used by the master in both drug design versions.
+#
+#  Randomly generated ligands are mostly short, so a large run contains
+#  many copies of the same ligand.  The master removes the duplicates
+#  before handing out work, and remembers the scores it has already
+#  received in a least-recently-used cache keyed by (protein, ligand).
+#  The cache can be saved to a file so that a later screen against the
+#  same protein does not score those ligands again.
+
+import json
+import os
+import time
+from collections import OrderedDict
+
+DFLT_cacheSize = 100000
+
+class ScoreCache:
+    # Least-recently-used mapping of (protein, ligand) to score.
+    #   maxSize:  most entries kept in memory (0 turns the cache off)
+    #   path:     optional JSON file the cache is loaded from and saved to
+
+    def __init__(self, maxSize=DFLT_cacheSize, path=None):
+        self.maxSize = maxSize
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # return the score of ligand lig against protein pro, or None
+    def get(self, pro, lig):
+        key = (pro, lig)
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    # remember the score s of ligand lig against protein pro
+    def put(self, pro, lig, s):
+        if self.maxSize <= 0:
+            return
+        key = (pro, lig)
+        self.entries[key] = s
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    # the file holds {protein: {ligand: score}}
+    def load(self):
+        with open(self.path) as f:
+            saved = json.load(f)
+        for pro, scores in saved.items():
+            for lig, s in scores.items():
+                self.put(pro, lig, s)
+
+    # Entries already in the file are kept, so scores evicted from
+    # memory during this run are not lost from the file.
+    def save(self):
+        if self.path is None:
+            return
+        saved = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                saved = json.load(f)
+        for (pro, lig), s in self.entries.items():
+            saved.setdefault(pro, {})[lig] = s
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(saved, f)
+        os.replace(tmpPath, self.path)
+
+class ResultLog:
+    # Append-only log of the scores received during a run, so that a run
+    # that is stopped part way can be started again without losing them.
+    #   path:     the log file; each line is a JSON object
+    #             {"protein": protein, "scores": {ligand: score, ...}}
+    #   protein:  the protein being screened; lines for others are ignored
+    #
+    # Scores are written in batches, at most every flushTime seconds or
+    # flushCount scores, so a large screen does not write one line per
+    # ligand.  A run that is killed may leave a partial last line, which is
+    # skipped when the log is read.
+
+    def __init__(self, path, protein, flushCount=1000, flushTime=1.0):
+        self.path = path
+        self.protein = protein
+        self.flushCount = flushCount
+        self.flushTime = flushTime
+        self.pending = {}
+        self.lastFlush = time.time()
+        self.file = None
+
+    # return a dictionary of ligand: score of everything already logged
+    def load(self):
+        scores = {}
+        if not os.path.exists(self.path):
+            return scores
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue    # cut off when an earlier run was stopped
+                if entry.get("protein") == self.protein:
+                    scores.update(entry["scores"])
+        return scores
+
+    # remember the scores of some ligands, writing them out if it is time
+    def add(self, ligands, scores):
+        for lig, s in zip(ligands, scores):
+            self.pending[lig] = s
+        if len(self.pending) >= self.flushCount or \
+           time.time() - self.lastFlush >= self.flushTime:
+            self.flush()
+
+    # write out the scores not yet in the file
+    def flush(self):
+        self.lastFlush = time.time()
+        if not self.pending:
+            return
+        if self.file is None:
+            # start on a new line if an earlier run was cut off mid-line
+            cutOff = False
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                with open(self.path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    cutOff = f.read(1) != b"\n"
+            self.file = open(self.path, "a")
+            if cutOff:
+                self.file.write("\n")
+        self.file.write(json.dumps({"protein": self.protein,
+                                    "scores": self.pending}) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = {}
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# function openScoreCache
+#   1 argument:  the command line arguments
+#   return:  a ScoreCache set up from --cache-size and --cache-file
+
+def openScoreCache(args):
+    return ScoreCache(args.cacheSize, args.cacheFile)
+
+# function splitByCache
+#   3 arguments:  a list of ligands, a protein sequence and a ScoreCache
+#   return:  list of distinct ligands that still need a score, in the order
+#            they first appear, and a dictionary of ligand: score for the
+#            ones whose score is already in the cache
+
+def splitByCache(ligands, pro, cache):
+    todo = []
+    known = {}
+    seen = set()
+    for lig in ligands:
+        if lig in seen:
+            continue
+        seen.add(lig)
+        s = cache.get(pro, lig)
+        if s is None:
+            todo.append(lig)
+        else:
+            known[lig] = s
+    return todo, known
@@ -0,0 +1,119 @@
+# Drug Design Exemplar:
+# Check that every scorer gives the same scores as the original one
+#
+#  The recursive score() in dd_functions.py is the reference: the faster
+#  scorers must give exactly the same score for every ligand and protein.
+#  This program scores many random pairs (short enough for the recursive
+#  scorer, and some with letters outside ASCII) with each of them, and
+#  with scoreLigands with and without a pruning threshold, and prints
+#  every pair that does not agree.  It also checks that ligands packed to
+#  be sent to the workers are unpacked unchanged.  It exits with status 1
+#  if anything is wrong.
+#
+#        python dd_check_scorers.py
+#        python dd_check_scorers.py --pairs 10000 --seed 3
+
+import argparse
+import random
+import sys
+
+from dd_functions import *
+
+# function randomString
+#   3 arguments:  a random.Random, the shortest and the longest length
+#   return:  a random string of letters, with a length between them
+#
+# A small alphabet is used half of the time, so strings share many letters
+# and the scores are not all tiny.  One string in ten also has letters that
+# take more than one byte, as a --ligand-file may have.
+
+def randomString(rng, shortest, longest):
+    choice = rng.random()
+    if choice < 0.1:
+        letters = "abcéñ€"
+    elif choice < 0.55:
+        letters = "abcdefghijklmnopqrstuvwxyz"
+    else:
+        letters = "abcde"
+    return "".join(rng.choice(letters) for i in range(rng.randint(shortest, longest)))
+
+# function checkScorers
+#   3 arguments:  a list of ligands, a protein and the list of reference scores
+#   return:  list of descriptions of the scores that differ from the reference
+
+def checkScorers(ligands, pro, expected):
+    problems = []
+    def compare(name, scores):
+        for lig, got, want in zip(ligands, list(scores), expected):
+            if got != want:
+                problems.append("{}: {} against {} gave {}, not {}"\
+                .format(name, lig, pro, got, want))
+
+    compare("scoreDP", [scoreDP(lig, pro) for lig in ligands])
+    compare("scoreBitParallel", [scoreBitParallel(lig, pro) for lig in ligands])
+    compare("scoreBatch", scoreBatch(ligands, pro).tolist())
+    for name in sorted(SCORERS):
+        compare("scoreLigands " + name, scoreLigands(ligands, pro, name).tolist())
+
+    # with a threshold, a score may be -1 only if it is below the threshold
+    for threshold in range(1, max(expected, default=0) + 2):
+        def checkPruned(name, scores):
+            for lig, got, want in zip(ligands, list(scores), expected):
+                if got != want and not (got == -1 and want < threshold):
+                    problems.append("{} threshold {}: {} against {} gave {}, not {}"\
+                    .format(name, threshold, lig, pro, got, want))
+        checkPruned("scoreDP", [scoreDP(lig, pro, threshold) for lig in ligands])
+        for name in sorted(SCORERS):
+            checkPruned("scoreLigands " + name,
+                        scoreLigands(ligands, pro, name, threshold).tolist())
+    return problems
+
+# function checkPacking
+#   1 argument:  a list of ligands
+#   return:  list of descriptions of the ligands that packLigands and
+#            unpackLigands, or packBatch and unpackBatch, did not give back
+
+def checkPacking(ligands):
+    problems = []
+    unpacked = unpackLigands(*packLigands(ligands))
+    if unpacked != ligands:
+        problems.append("unpackLigands gave {}, not {}".format(unpacked, ligands))
+    threshold, unpacked = unpackBatch(packBatch(3, ligands))
+    if unpacked != ligands or threshold != 3:
+        problems.append("unpackBatch gave {}, not {}".format(unpacked, ligands))
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pairs', metavar='count', type=int, default=3000,
+        help='number of ligand and protein pairs to check')
+    parser.add_argument('--seed', type=int, default=None,
+        help='seed of the random ligands and proteins')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    # each protein is checked against a group of ligands, so scoreBatch
+    # and scoreLigands see ligands of different lengths together
+    group = 20
+    problems = []
+    for first in range(0, args.pairs, group):
+        pro = randomString(rng, 0, 12)
+        ligands = [randomString(rng, 0, 7) for i in range(min(group, args.pairs - first))]
+        expected = [score(lig, pro) for lig in ligands]
+        problems.extend(checkScorers(ligands, pro, expected))
+
+    # ligands sent to the workers must come back unchanged, including those
+    # from a --ligand-file with letters that take more than one byte
+    problems.extend(checkPacking(["abc", "café", "xyz", "razvex"]))
+    problems.extend(checkPacking(["ab", "", "cd"]))
+    problems.extend(checkPacking([]))
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        print("{} problems found".format(len(problems)))
+        sys.exit(1)
+    print("All scorers agree with the recursive scorer on {} pairs".format(args.pairs))
+
+if __name__ == "__main__":
+    main()
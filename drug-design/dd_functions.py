@@ -1,73 +1,125 @@
-import random
-import string
+import heapq
+from collections import Counter
+import math
+import struct
 import argparse
-from mpi4py import MPI
+import os
+import sys
+import numpy as np
+
+from dd_cache import DFLT_cacheSize
+from dd_ligands import *
+
+# The phase timer is shared with the fire programs, one directory up.  It
+# and mpi4py.MPI are imported only by the functions that use them, since
+# importing MPI starts it, and dd_screen.py runs without MPI.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
 DFLT_maxLigand = 5
 DFLT_nLigands = 120
+DFLT_scorer = "dp"
+DFLT_top = 1
 #DFLT_protein = "the cat in the hat wore the hat to the cat hat party"
 #shorter protein takes less time
 #DFLT_protein = "Cwm fjord bank glyphs vext quiz"
 DFLT_protein = "How razorback-jumping frogs can level six piqued gymnasts"
 
 # function getCOmmandLineArgs
+#   optional arguments:  a function that adds the options used only by one
+#                        of the programs to the argparse parser, a list of
+#                        arguments to parse instead of the command line,
+#                        and earlier arguments whose values are kept unless
+#                        the new ones change them
+#   return:  the parsed command line arguments
 
-def getCommandLineArgs():
+def getCommandLineArgs(addArguments=None, argv=None, namespace=None):
     parser = argparse.ArgumentParser(
         description="CSinParallel Drug Design simulation")
 
+    # with earlier arguments, a count that is not given keeps its old value
     parser.add_argument('nLigands', metavar='count', type=int, nargs='?',
-        default=DFLT_nLigands, help='number of ligands to generate')
+        default=DFLT_nLigands if namespace is None else namespace.nLigands,
+        help='number of ligands to generate')
     parser.add_argument('--maxLigand', metavar='max-length', type=int, nargs='?',
         default=DFLT_maxLigand, help='maximum length of a ligand')
+    parser.add_argument('--seed', type=int, default=DFLT_seed,
+        help='seed for the random ligands')
+    parser.add_argument('--ligand-file', dest='ligandFile', metavar='file',
+        default=None,
+        help='read the ligands from this file, one per line (lines starting '
+             'with > are skipped), instead of generating them')
+    parser.add_argument('--mpi-io', dest='mpiIO', action='store_true',
+        help='read --ligand-file with MPI-IO instead of a memory map')
+    parser.add_argument('--generate-locally', dest='generateLocally',
+        action='store_true',
+        help='each process makes, or reads from --ligand-file, the ligands it '
+             'scores itself, so none are sent (no duplicate removal or cache '
+             'file)')
     parser.add_argument('--protein', metavar='protein', type=str, nargs='?',
         default=DFLT_protein, help='protein string to compare ligands against')
+    parser.add_argument('--proteins', metavar='protein', nargs='+',
+        default=None,
+        help='screen the ligands against each of these proteins')
+    parser.add_argument('--protein-file', dest='proteinFile', metavar='file',
+        default=None,
+        help='screen the ligands against each protein in this file, one per line')
+    parser.add_argument('--scorer', choices=sorted(SCORERS),
+        default=DFLT_scorer,
+        help='scoring algorithm: recursive is the original exponential one')
+    parser.add_argument('--cache-size', dest='cacheSize', metavar='entries',
+        type=int, default=DFLT_cacheSize,
+        help='number of ligand scores the master remembers (0 for none)')
+    parser.add_argument('--cache-file', dest='cacheFile', metavar='file',
+        default=None,
+        help='file of saved scores, read at the start and updated at the end')
+    parser.add_argument('--top', metavar='k', type=int, default=DFLT_top,
+        help='report the k highest scoring ligands (ties are all reported)')
+    parser.add_argument('--prune', action='store_true',
+        help='skip ligands that cannot score as high as the best found so far')
+    parser.add_argument('--timing', action='store_true',
+        help='report the time each process spent computing, sending and waiting')
+    parser.add_argument('--trace', metavar='file', default=None,
+        help='write a timeline of each process to this file in Chrome '
+             'trace format; implies --timing')
     parser.add_argument('--verbose', action='store_const', const=True,
                         default=False, help='print verbose output')
-    args = parser.parse_args()
+    if addArguments is not None:
+        addArguments(parser)
+    args = parser.parse_args(argv, namespace)
     return args
 
-def genRandomLigands(args):
-    random.seed(1000)
-    ligands = []
-    for l in range(args.nLigands):
-        ligands.append(makeLigand(args.maxLigand))
-    return ligands
+# function getProteins
+#   1 argument:  the command line arguments
+#   return:  list of the proteins to screen against: the lines of
+#            --protein-file, or the --proteins, or else just --protein
+
+def getProteins(args):
+    if args.proteinFile is not None:
+        with open(args.proteinFile) as f:
+            return [line.strip() for line in f if line.strip()]
+    if args.proteins is not None:
+        return args.proteins
+    return [args.protein]
+
+# function genLigandList
+#   1 argument:  the command line arguments
+#   return:  the whole list of ligands described by the arguments (see
+#            openLigandSource in dd_ligands.py)
 
-# If args.nLigands <=18, create a pre-determined set of example ligands.
-# Otherwise, create a set of ligands whose length randomly varies from 2
-# to args.maxLigand
 def genLigandList(args):
-    if (args.nLigands <= 18):
-        ligands = ["razvex", "qudgy", "afrs", "sst", "pgfht", "rt", "id", \
-        "how", "aaddh",  "df", "os", "hid", \
-        "sad", "fl", "rd", "edp", "dfgt", "spa"]
-        return ligands[0:args.nLigands]
-    else:
-        return genRandomLigands(args)
-
-# function makeLigand
-#   1 argument:  maximum length of a ligand
-#   return:  a random ligand string of random length between 2 and arg1
-
-def makeLigand(maxLength):
-#    len = random.randint(2, maxLength)
-    # So the times do not get too large, create
-    # more ligands of length 2, 3 by using a gamma distribution
-    len = int(random.gammavariate(4.2, 0.8))
-    if (len < 2):
-        len = 2
-    elif (len > maxLength):
-        len = maxLength
-
-    ligand = ""
-    for c in range(len):
-        ligand = ligand + string.ascii_lowercase[random.randint(0,25)]
-    return ligand
+    source = openLigandSource(args)
+    ligands = source.getRange(0, len(source))
+    source.close()
+    return ligands
 
 # function score
 #   2 arguments:  a ligand and a protein sequence
 #   return:  int, simulated binding score for ligand arg1 against protein arg2
+#
+# The score is the length of the longest common subsequence of the two
+# strings.  This recursive version is the original reference implementation:
+# it is easy to read but its running time grows exponentially with the
+# length of the ligand.  The other scorers below must give identical scores.
 
 def score(lig, pro):
     if len(lig) == 0 or len(pro) == 0:
@@ -77,27 +129,522 @@ def score(lig, pro):
     else:
         return max(score(lig[1:], pro), score(lig, pro[1:]))
 
-# functions used by Master
+# function scoreDP
+#   2 arguments:  a ligand and a protein sequence
+#   optional argument:  a threshold score
+#   return:  int, same score as score(), computed by dynamic programming,
+#            or -1 once it is clear the score will be below the threshold
+#
+# Fills the longest common subsequence table one ligand letter at a time,
+# reusing a single row of len(pro)+1 entries, so it takes
+# O(len(lig)*len(pro)) time instead of exponential time.  Each remaining
+# letter can add at most one to the score, so the work can stop early.
+
+def scoreDP(lig, pro, threshold=-1):
+    row = [0] * (len(pro) + 1)
+    for i, l in enumerate(lig):
+        diag = 0     # row[j-1] from the previous ligand letter
+        for j in range(1, len(pro) + 1):
+            up = row[j]
+            if l == pro[j-1]:
+                row[j] = diag + 1
+            elif row[j-1] > up:
+                row[j] = row[j-1]
+            diag = up
+        if row[-1] + len(lig) - i - 1 < threshold:
+            return -1
+    return row[-1]
+
+# function scoreBitParallel
+#   2 arguments:  a ligand and a protein sequence
+#   return:  int, same score as score(), computed with bit operations
+#
+# Bit-vector longest common subsequence (Hyyro's variant of Allison-Dix).
+# One bit per ligand letter is kept in a python int, and each protein letter
+# updates all of them at once with a few integer operations, so the work is
+# O(len(pro)) big-integer steps.
+
+def scoreBitParallel(lig, pro):
+    if len(lig) == 0:
+        return 0
+    # for each letter, the positions in the ligand where it occurs
+    matches = {}
+    for i, l in enumerate(lig):
+        matches[l] = matches.get(l, 0) | (1 << i)
+
+    allOnes = (1 << len(lig)) - 1
+    v = allOnes
+    for p in pro:
+        u = v & matches.get(p, 0)
+        v = ((v + u) | (v - u)) & allOnes
+    # each zero bit left in v is one letter of the common subsequence
+    return len(lig) - bin(v).count("1")
+
+# function packLigandMatrix
+#   1 argument:  a list of ligands
+#   return:  numpy array with one row per ligand holding the code of each of
+#            its letters, padded on the right with zeros to the length of
+#            the longest one
+#
+# ASCII ligands are packed one byte per letter.  Others, as may come from a
+# --ligand-file, are packed as 32-bit Unicode code points, so each letter
+# is still one element however many bytes it takes in UTF-8.
+
+def packLigandMatrix(ligands):
+    width = max([len(lig) for lig in ligands], default=0)
+    if width == 0:
+        return np.zeros((len(ligands), 0), dtype=np.uint8)
+    if all(map(str.isascii, ligands)):
+        packed = np.array([lig.encode() for lig in ligands], dtype="S{}".format(width))
+        return packed.view(np.uint8).reshape(len(ligands), width)
+    packed = np.array(ligands, dtype="U{}".format(width))
+    return packed.view(np.uint32).reshape(len(ligands), width)
+
+# function scoreBatch
+#   2 arguments:  a list of ligands and a protein sequence
+#   return:  numpy array of int, score() of each ligand against the protein
+#
+# All of the ligands are scored together.  For each protein letter, one
+# vectorized step updates the dynamic programming row of every ligand:
+# each entry becomes the larger of its old value and the diagonal value
+# plus one where the letters match, and a running maximum along the row
+# finishes the step.  The zero padding never matches a protein letter, so
+# padded ligands get the right score.  Large lists are scored in blocks of
+# blockSize ligands so the rows stay in cache.
+
+def scoreBatch(ligands, pro, blockSize=4096):
+    scores = np.zeros(len(ligands), dtype=np.int32)
+    for start in range(0, len(ligands), blockSize):
+        ligs = packLigandMatrix(ligands[start:start+blockSize])
+        scores[start:start+len(ligs)] = scorePacked(ligs, pro)
+    return scores
+
+# function scorePacked
+#   2 arguments:  ligands packed by packLigandMatrix and a protein sequence
+#   return:  numpy array of the score of each ligand, as in scoreBatch
+
+def scorePacked(ligs, pro):
+    nLigs, width = ligs.shape
+    if width == 0:
+        return np.zeros(nLigs, dtype=np.int32)
+    rowType = np.uint8 if width < 255 else np.int32
+    row = np.zeros((nLigs, width + 1), dtype=rowType)
+    largest = np.iinfo(ligs.dtype).max
+    for p in map(ord, pro):
+        if p > largest:
+            continue    # matches no letter of a ligand packed in bytes
+        step = np.maximum(row[:, 1:], row[:, :-1] + (ligs == p))
+        np.maximum.accumulate(step, axis=1, out=row[:, 1:])
+    return row[:, -1]
+
+# function scoreNumpy
+#   2 arguments:  a ligand and a protein sequence
+#   return:  int, score() of the ligand computed with scoreBatch
+
+def scoreNumpy(lig, pro):
+    return int(scoreBatch([lig], pro)[0])
+
+# the available scoring functions, selected with --scorer
+SCORERS = {
+    "recursive": score,
+    "dp": scoreDP,
+    "bitparallel": scoreBitParallel,
+    "numpy": scoreNumpy,
+}
+
+# function getScorer
+#   1 argument:  name of a scorer, one of the keys of SCORERS
+#   return:  the scoring function with that name
+
+def getScorer(name):
+    return SCORERS[name]
+
+# function scoreLigands
+#   3 arguments:  a list of ligands, a protein sequence and a scorer name
+#   optional argument:  a threshold score; ligands that cannot reach it
+#                       may be skipped (pruned)
+#   return:  numpy array of int, the score of each ligand against the
+#            protein, or -1 for each pruned ligand
+#
+# The numpy scorer computes the whole list in one call to scoreBatch; the
+# others score one ligand at a time.  With a threshold, a cheap upper bound
+# (scoreUpperBound) is checked first, and the dp scorer also stops as soon
+# as a ligand can no longer reach the threshold.
+
+def scoreLigands(ligands, pro, scorerName, threshold=-1):
+    if threshold <= 0:     # every ligand scores at least 0
+        if scorerName == "numpy":
+            return scoreBatch(ligands, pro)
+        scoreLigand = getScorer(scorerName)
+        return np.array([scoreLigand(lig, pro) for lig in ligands], dtype=np.int32)
+
+    proteinCounts = Counter(pro)
+    keep = [i for i, lig in enumerate(ligands)
+            if scoreUpperBound(lig, proteinCounts) >= threshold]
+    scores = np.full(len(ligands), -1, dtype=np.int32)
+    if scorerName == "dp":
+        for i in keep:
+            scores[i] = scoreDP(ligands[i], pro, threshold)
+    else:
+        scores[keep] = scoreLigands([ligands[i] for i in keep], pro, scorerName)
+    return scores
+
+# function scoreUpperBound
+#   2 arguments:  a ligand and a collections.Counter of the protein's letters
+#   return:  int, a number the ligand's score cannot be above: the number of
+#            letters the ligand and protein have in common, counting
+#            repeated letters, which is also at most min(len(lig), len(pro))
+
+def scoreUpperBound(lig, proteinCounts):
+    return sum([min(n, proteinCounts[l]) for l, n in Counter(lig).items()])
+
+# function estimateCost
+#   3 arguments:  a ligand, a protein sequence and a scorer name
+#   return:  number, estimate of the relative time needed to score the ligand
+#
+# The recursive scorer may explore every way of pairing up the letters of
+# the ligand with those of the protein, which grows like the binomial
+# coefficient (len(lig)+len(pro) choose len(lig)).  The other scorers do
+# work proportional to the size of the dynamic programming table.
+
+def estimateCost(lig, pro, scorerName):
+    if scorerName == "recursive":
+        return math.comb(len(lig) + len(pro), len(lig))
+    return (len(lig) + 1) * len(pro)
+
+# function partitionLigands
+#   5 arguments:  a list of ligands, number of parts, a protein sequence,
+#                 a scorer name and a partition method:
+#       block:    consecutive ligands, counts differing by at most 1
+#       strided:  ligand i goes to part i % nParts
+#       lpt:      greedy longest-processing-time: taking the ligands in
+#                 order of decreasing estimated cost, give each one to the
+#                 part with the smallest estimated total so far
+#   return:  a list of nParts lists of indexes into the ligand list
+
+def partitionLigands(ligands, nParts, pro, scorerName, method):
+    if method == "block":
+        return [list(range(*blockRange(len(ligands), nParts, p)))
+                for p in range(nParts)]
+    if method == "strided":
+        return [list(range(p, len(ligands), nParts)) for p in range(nParts)]
+
+    costs = [estimateCost(lig, pro, scorerName) for lig in ligands]
+    parts = [[] for p in range(nParts)]
+    loads = [(0, p) for p in range(nParts)]   # heap of (load, part)
+    for i in sorted(range(len(ligands)), key=lambda i: costs[i], reverse=True):
+        load, p = heapq.heappop(loads)
+        parts[p].append(i)
+        heapq.heappush(loads, (load + costs[i], p))
+    return parts
+
+# function packLigands
+#   1 argument:  a list of ligands
+#   return:  uint8 numpy array of all the ligand letters one after another,
+#            and int32 numpy array of the length of each ligand, ready to
+#            send with the buffer versions of the MPI calls
+
+def packLigands(ligands):
+    encoded = [lig.encode() for lig in ligands]
+    letters = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    lengths = np.array([len(e) for e in encoded], dtype=np.int32)
+    return letters, lengths
+
+# function unpackLigands
+#   2 arguments:  the two arrays returned by packLigands
+#   return:  the list of ligands
+
+def unpackLigands(letters, lengths):
+    ends = np.cumsum(lengths).tolist()
+    starts = [0] + ends[:-1]
+    data = letters.tobytes()
+    text = data.decode()
+    if len(text) == len(data):      # one byte per letter, as is usual
+        return [text[start:end] for start, end in zip(starts, ends)]
+    # the lengths are in bytes, so other ligands are cut out as bytes
+    return [data[start:end].decode() for start, end in zip(starts, ends)]
+
+# function packBatch
+#   2 arguments:  a pruning threshold and a list of ligands
+#   return:  bytes holding both, to send as one buffer message: an int32
+#            header of the threshold and the number of ligands, then the
+#            ligands separated by newlines
+#
+# Ligands never contain a newline, so splitting on it is the quickest way
+# to get the list back; for small batches that matters more than the size.
+
+BATCH_HEADER = struct.Struct("<ii")
+
+def packBatch(threshold, ligands):
+    return BATCH_HEADER.pack(threshold, len(ligands)) + "\n".join(ligands).encode()
+
+# function batchSizeBound
+#   2 arguments:  number of ligands and the most bytes in one ligand
+#   return:  the most bytes packBatch can return for that many ligands
+
+def batchSizeBound(nLigands, ligandBytes):
+    return BATCH_HEADER.size + nLigands * (ligandBytes + 1)
+
+# function unpackBatch
+#   1 argument:  bytes (or a buffer) returned by packBatch
+#   return:  the threshold and the list of ligands
+
+def unpackBatch(message):
+    message = bytes(message)
+    threshold, n = BATCH_HEADER.unpack_from(message)
+    if n == 0:
+        return threshold, []
+    return threshold, message[BATCH_HEADER.size:].decode().split("\n")
+
+# function scatterLigands
+#   3 arguments:  a communicator, on the root process a list holding one
+#                 list of ligands for each process (None on the others),
+#                 and the rank of the root process
+#   return:  the list of ligands sent to this process
+#
+# The ligands are packed with packLigands and delivered with Scatterv, so
+# the root sends one block of bytes to each process instead of pickling a
+# python list for each one.
+
+def scatterLigands(comm, chunks, root=0):
+    from mpi4py import MPI
+    if comm.Get_rank() == root:
+        packed = [packLigands(chunk) for chunk in chunks]
+        counts = np.array([[len(lengths), len(letters)] for letters, lengths in packed],
+                          dtype=np.int32)
+        allLengths = np.concatenate([lengths for letters, lengths in packed])
+        allLetters = np.concatenate([letters for letters, lengths in packed])
+        lengthDispls = np.cumsum(counts[:, 0]) - counts[:, 0]
+        letterDispls = np.cumsum(counts[:, 1]) - counts[:, 1]
+        sendLengths = [allLengths, counts[:, 0], lengthDispls, MPI.INT]
+        sendLetters = [allLetters, counts[:, 1], letterDispls, MPI.BYTE]
+    else:
+        counts = None
+        sendLengths = None
+        sendLetters = None
+
+    myCounts = np.empty(2, dtype=np.int32)
+    comm.Scatter(counts, myCounts, root=root)
+    lengths = np.empty(myCounts[0], dtype=np.int32)
+    letters = np.empty(myCounts[1], dtype=np.uint8)
+    comm.Scatterv(sendLengths, lengths, root=root)
+    comm.Scatterv(sendLetters, letters, root=root)
+    return unpackLigands(letters, lengths)
+
+# function gatherScores
+#   4 arguments:  a communicator, this process's scores, on the root process
+#                 the number of scores each process sends (None on the
+#                 others), and the rank of the root process
+#   return:  on the root, int32 numpy array of every process's scores in
+#            rank order; None on the others
+
+def gatherScores(comm, scores, counts, root=0):
+    from mpi4py import MPI
+    if comm.Get_rank() == root:
+        counts = np.array(counts, dtype=np.int32)
+        displs = np.cumsum(counts) - counts
+        allScores = np.empty(counts.sum(), dtype=np.int32)
+        recv = [allScores, counts, displs, MPI.INT]
+    else:
+        allScores = None
+        recv = None
+    comm.Gatherv(np.ascontiguousarray(scores, dtype=np.int32), recv, root=root)
+    return allScores
+
+# Keep track of the k highest scoring ligands seen so far.
+#
+# Ligands are grouped by score, and a heap holds the distinct scores so the
+# lowest one can be dropped quickly.  Ligands that tie with the lowest kept
+# score are all kept, so there can be more than k ligands.  With k = 1 this
+# is the maximum score and every ligand that achieved it.  A ligand that is
+# added again, for example by another process, is only kept once.
+
+class TopK:
+    def __init__(self, k=1):
+        self.k = k
+        self.ligandsByScore = {}   # score: list of ligands with that score
+        self.scores = []           # heap of the keys of ligandsByScore
+        self.count = 0             # number of ligands kept
+        self.kept = set()          # the ligands kept
+
+    # lowest score that can still be added; -1 until k ligands are kept
+    def threshold(self):
+        if self.count < self.k:
+            return -1
+        return self.scores[0]
+
+    # a negative score means the ligand was pruned and is ignored
+    def add(self, score, lig):
+        if score < 0 or score < self.threshold() or lig in self.kept:
+            return
+        if score not in self.ligandsByScore:
+            self.ligandsByScore[score] = []
+            heapq.heappush(self.scores, score)
+        self.ligandsByScore[score].append(lig)
+        self.kept.add(lig)
+        self.count += 1
+        # drop the lowest score while the others hold at least k ligands
+        while self.count - len(self.ligandsByScore[self.scores[0]]) >= self.k:
+            lowest = heapq.heappop(self.scores)
+            dropped = self.ligandsByScore.pop(lowest)
+            self.kept.difference_update(dropped)
+            self.count -= len(dropped)
+
+    def addAll(self, scores, ligands):
+        for score, lig in zip(scores, ligands):
+            self.add(int(score), lig)
+
+    def merge(self, other):
+        for score, ligands in other.ligandsByScore.items():
+            for lig in ligands:
+                self.add(score, lig)
+
+    # list of (score, list of ligands), highest score first
+    def best(self):
+        return [(score, self.ligandsByScore[score])
+                for score in sorted(self.ligandsByScore, reverse=True)]
+
+# function mergeTopK
+#   2 arguments:  two TopK objects (and the datatype argument that MPI
+#                 passes to user-defined reduction operations, unused)
+#   return:  a TopK holding the best ligands of both
+
+def mergeTopK(a, b, datatype=None):
+    merged = TopK(max(a.k, b.k))
+    merged.merge(a)
+    merged.merge(b)
+    return merged
+
+TOPK_OP = None
+
+# function reduceTopK
+#   3 arguments:  a communicator, this process's TopK and the root's rank
+#   return:  on the root, a TopK with the best ligands of all the processes;
+#            None on the others
 #
-# receive next finished result
-def masterReceiveResults(comm, args):
-    stat = MPI.Status()
-    results = comm.recv(source=MPI.ANY_SOURCE, status=stat)
-    workerId = stat.Get_source()
-    printIf(args.verbose, "master received {} with score {} from {}"\
-    .format(results[1], results[0], workerId), flush=True)
-    return results, workerId
-
-# Keep track of the maximum score and ligand that achieved it
-def updateMaximum(score, lig, maxScore, maxScoreLigands):
-    if score > maxScore:
-        # new best scoring one
-        maxScore = score
-        maxScoreLigands = lig
-    elif score == maxScore:
-        maxScoreLigands = maxScoreLigands + "," + lig
-
-    return maxScore, maxScoreLigands
+# Each process sends one message, so the cost grows with the number of
+# processes rather than with the number of ligands.
+
+def reduceTopK(comm, topK, root=0):
+    global TOPK_OP
+    from mpi4py import MPI
+    if TOPK_OP is None:
+        TOPK_OP = MPI.Op.Create(mergeTopK, commute=True)
+    return comm.reduce(topK, op=TOPK_OP, root=root)
+
+# function pruneThreshold
+#   2 arguments:  the command line arguments and a TopK
+#   return:  the score a ligand must reach to matter, or -1 (prune nothing)
+#            if pruning was not asked for
+
+def pruneThreshold(args, topK):
+    if not args.prune:
+        return -1
+    return topK.threshold()
+
+# function scoreIntoTopK
+#   3 arguments:  a list of ligands, the command line arguments and a TopK
+#   return:  numpy array of the score of each ligand (-1 if pruned)
+#   state change:  the scored ligands are added to the TopK
+#
+# With --prune the ligands are scored PRUNE_BLOCK at a time, so the
+# threshold rises as good ligands are found.
+
+PRUNE_BLOCK = 256
+
+def scoreIntoTopK(ligands, args, topK):
+    blockSize = PRUNE_BLOCK if args.prune else max(len(ligands), 1)
+    scores = np.zeros(len(ligands), dtype=np.int32)
+    for start in range(0, len(ligands), blockSize):
+        block = ligands[start:start+blockSize]
+        scores[start:start+len(block)] = scoreLigands(block, args.protein,
+            args.scorer, pruneThreshold(args, topK))
+        topK.addAll(scores[start:start+len(block)], block)
+    return scores
+
+# function scoreChunk
+#   5 arguments:  a list of ligands, a protein, a scorer name, the number of
+#                 best scores to keep and a pruning threshold
+#   return:  a TopK of the ligands and the number of them that were pruned
+#
+# A self-contained task for an executor (see dd_screen.py): only the best
+# ligands are sent back, not every score.
+
+def scoreChunk(ligands, pro, scorerName, k, threshold=-1):
+    scores = scoreLigands(ligands, pro, scorerName, threshold)
+    topK = TopK(k)
+    topK.addAll(scores, ligands)
+    return topK, int((scores < 0).sum())
+
+# function guidedChunkSize
+#   3 arguments:  number of ligands not yet handed out, number of processes
+#                 scoring them and the smallest chunk
+#   return:  number of ligands to hand out next with guided self-scheduling:
+#            a share of the remaining ones that shrinks as they run out
+
+def guidedChunkSize(remaining, numCores, minChunk):
+    return max(minChunk, math.ceil(remaining / (2 * numCores)))
+
+# function costTotals
+#   3 arguments:  a list of ligands, a protein sequence and a scorer name
+#   return:  numpy array of running totals of the estimated costs of the
+#            ligands: element i is the cost of the first i of them
+
+def costTotals(ligands, pro, scorerName):
+    costs = np.array([estimateCost(lig, pro, scorerName) for lig in ligands],
+                     dtype=np.float64)
+    return np.concatenate(([0.0], np.cumsum(costs)))
+
+# function guidedCostChunkSize
+#   4 arguments:  running totals of the estimated costs (from costTotals),
+#                 number of ligands already handed out (an int, or a numpy
+#                 array of them), number of processes scoring them and the
+#                 smallest chunk
+#   return:  number of ligands to hand out next with guided self-scheduling
+#            by cost: enough of them to make up a share of the remaining
+#            estimated cost that shrinks as it runs out
+#
+# When the ligands are sorted by decreasing cost, guidedChunkSize would give
+# the first process a share of the ligands holding far more than its share
+# of the work; this gives each chunk a share of the work instead.
+
+def guidedCostChunkSize(totals, handedOut, numCores, minChunk):
+    target = totals[handedOut] + (totals[-1] - totals[handedOut]) / (2 * numCores)
+    end = np.searchsorted(totals, target, side='left')
+    return np.maximum(max(minChunk, 1), end - handedOut)
+
+# function printTopK
+#   1 argument:  a TopK
+#   state change:  prints the best scores and the ligands that achieved them
+
+def printTopK(topK):
+    best = topK.best()
+    if topK.k == 1:
+        score, ligands = best[0] if best else (-1, [])
+        print('The maximum score is', score)
+        print('Achieved by ligand(s)', ",".join(ligands))
+    else:
+        print('The {} highest scoring ligands:'.format(topK.k))
+        for score, ligands in best:
+            print('{0:6}  {1}'.format(score, ",".join(ligands)))
+
+# function openPhaseTimer
+#   2 arguments:  a communicator and the command line arguments
+#   return:  a PhaseTimer, which does nothing unless --timing or --trace
+#            was given (see phase_timer.py)
+
+def openPhaseTimer(comm, args):
+    from phase_timer import PhaseTimer
+    trace = args.trace is not None
+    return PhaseTimer(comm, args.timing or trace, trace)
+
+# function collectivePhase
+#   2 arguments:  a communicator and the root of a reduction or gather
+#   return:  the phase this process spends in it: the root waits to
+#            receive, the others send
+
+def collectivePhase(comm, root=0):
+    return "recv_wait" if comm.Get_rank() == root else "send"
 
 # function printIf - used for verbose output
 #   variable number of arguments:  a boolean, then valid arguments for print
@@ -0,0 +1,245 @@
+# Sources of ligands for the drug design programs.
+#
+#  A ligand source holds a numbered library of ligands and can produce any
+#  range of them, so a process can make just the ligands it will score
+#  instead of receiving them from the master.
+#
+#  The random library is made in blocks of GEN_BLOCK ligands.  Block b is
+#  drawn from its own counter-based (Philox) random stream, seeded from the
+#  pair (seed, b), so ligand i is the same no matter which process makes it
+#  or how many processes there are.
+
+import mmap
+import os
+import numpy as np
+
+DFLT_seed = 1000
+GEN_BLOCK = 4096
+
+# ligands used when 18 or fewer are asked for
+EXAMPLE_LIGANDS = ["razvex", "qudgy", "afrs", "sst", "pgfht", "rt", "id", \
+    "how", "aaddh",  "df", "os", "hid", \
+    "sad", "fl", "rd", "edp", "dfgt", "spa"]
+
+class FixedLigands:
+    # A library given as a python list of ligands.
+
+    def __init__(self, ligands):
+        self.ligands = ligands
+
+    def __len__(self):
+        return len(self.ligands)
+
+    # return the list of ligands numbered start up to stop
+    def getRange(self, start, stop):
+        return self.ligands[start:stop]
+
+    # generate the ligands numbered start up to stop, a list at a time
+    def iterRange(self, start, stop):
+        for first in range(start, stop, GEN_BLOCK):
+            yield self.getRange(first, min(first + GEN_BLOCK, stop))
+
+    # let go of any open file; the source cannot be used after this
+    def close(self):
+        pass
+
+class RandomLigands(FixedLigands):
+    # A library of nLigands random ligands.  So the times do not get too
+    # large, there are more ligands of length 2 and 3: lengths come from a
+    # gamma distribution and are limited to between 2 and maxLigand.
+
+    def __init__(self, nLigands, maxLigand, seed=DFLT_seed):
+        self.nLigands = nLigands
+        self.maxLigand = maxLigand
+        self.seed = seed
+        # the last block made, as (block number, list of ligands), so taking
+        # a few ligands at a time from one block makes it only once
+        self.lastBlock = (None, None)
+
+    def __len__(self):
+        return self.nLigands
+
+    # return the list of ligands in block number b
+    def makeBlock(self, b):
+        first = b * GEN_BLOCK
+        n = min(GEN_BLOCK, self.nLigands - first)
+        stream = np.random.SeedSequence(self.seed, spawn_key=(b,))
+        rng = np.random.Generator(np.random.Philox(stream))
+        lengths = rng.gamma(4.2, 0.8, size=n).astype(np.int64)
+        lengths = np.clip(lengths, 2, self.maxLigand)
+        letters = rng.integers(ord('a'), ord('z') + 1,
+                               size=(n, self.maxLigand), dtype=np.uint8)
+        # zero bytes past the end of each ligand are dropped by the S type
+        letters[np.arange(self.maxLigand) >= lengths[:, None]] = 0
+        fixedWidth = letters.view("S{}".format(self.maxLigand)).ravel()
+        return fixedWidth.astype(str).tolist()
+
+    # return the list of ligands in block number b, made again only if it
+    # is not the last block made
+    def getBlock(self, b):
+        if self.lastBlock[0] != b:
+            self.lastBlock = (b, self.makeBlock(b))
+        return self.lastBlock[1]
+
+    def getRange(self, start, stop):
+        ligands = []
+        for ligs in self.iterRange(start, stop):
+            ligands.extend(ligs)
+        return ligands
+
+    def iterRange(self, start, stop):
+        stop = min(stop, self.nLigands)
+        for b in range(start // GEN_BLOCK, (stop + GEN_BLOCK - 1) // GEN_BLOCK):
+            first = b * GEN_BLOCK
+            block = self.getBlock(b)
+            yield block[max(start - first, 0):stop - first]
+
+class FileLigands(FixedLigands):
+    # A library read from a text file with one ligand per line.  Blank lines
+    # and FASTA-style header lines starting with '>' are skipped.
+    #
+    # The file is memory-mapped, so only the parts that are used are read.
+    # The first time a file is used, an index of the byte offset and length
+    # of every ligand is built and saved next to it (in path + ".idx.npz");
+    # later runs load the index instead of scanning the file again.  With
+    # useMpiIO the ranges are read with MPI-IO instead of the memory map.
+    # Either way the file stays open until close() is called.
+
+    def __init__(self, path, useMpiIO=False):
+        self.path = path
+        self.useMpiIO = useMpiIO
+        self.offsets, self.lengths = loadLigandIndex(path)
+        self.data = None
+        self.mpiFile = None
+        if useMpiIO:
+            from mpi4py import MPI
+            self.mpiFile = MPI.File.Open(MPI.COMM_SELF, path, MPI.MODE_RDONLY)
+        elif os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # return the bytes of the file from offset first up to offset last
+    def readBytes(self, first, last):
+        if not self.useMpiIO:
+            return self.data[first:last]
+        buf = bytearray(last - first)
+        self.mpiFile.Read_at(first, buf)
+        return bytes(buf)
+
+    def close(self):
+        if self.mpiFile is not None:
+            self.mpiFile.Close()
+            self.mpiFile = None
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    def getRange(self, start, stop):
+        stop = min(stop, len(self))
+        if start >= stop:
+            return []
+        first = int(self.offsets[start])
+        last = int(self.offsets[stop-1] + self.lengths[stop-1])
+        data = self.readBytes(first, last)
+        ligands = []
+        for offset, length in zip((self.offsets[start:stop] - first).tolist(),
+                                  self.lengths[start:stop].tolist()):
+            ligands.append(data[offset:offset+length].decode())
+        return ligands
+
+# function buildLigandIndex
+#   1 argument:  path of a ligand file
+#   return:  int64 numpy array of the byte offset of each ligand in the
+#            file and int32 numpy array of their lengths
+#
+# The file is scanned for newlines SCAN_BLOCK bytes at a time, so even a
+# very large file is never all in memory at once.
+
+SCAN_BLOCK = 1 << 26
+
+def buildLigandIndex(path):
+    size = os.path.getsize(path)
+    if size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+    with open(path, "rb") as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        newlines = []
+        for first in range(0, size, SCAN_BLOCK):
+            block = np.frombuffer(data, dtype=np.uint8, offset=first,
+                                  count=min(SCAN_BLOCK, size - first))
+            newlines.append(np.flatnonzero(block == ord('\n')) + first)
+        lineEnds = np.concatenate(newlines)
+        if len(lineEnds) == 0 or lineEnds[-1] != size - 1:
+            lineEnds = np.append(lineEnds, size)    # last line has no newline
+        lineStarts = np.concatenate(([0], lineEnds[:-1] + 1))
+
+        allBytes = np.frombuffer(data, dtype=np.uint8)
+        lineEnds = lineEnds.copy()
+        notEmpty = lineEnds > lineStarts
+        # drop the \r of files with Windows line endings
+        endsInReturn = notEmpty.copy()
+        endsInReturn[notEmpty] = allBytes[lineEnds[notEmpty] - 1] == ord('\r')
+        lineEnds[endsInReturn] -= 1
+        notEmpty = lineEnds > lineStarts
+        # skip blank lines and header lines
+        isLigand = notEmpty.copy()
+        isLigand[notEmpty] = allBytes[lineStarts[notEmpty]] != ord('>')
+        # the map cannot be closed while an array still uses it
+        del block, allBytes
+    offsets = lineStarts[isLigand].astype(np.int64)
+    lengths = (lineEnds - lineStarts)[isLigand].astype(np.int32)
+    return offsets, lengths
+
+# function loadLigandIndex
+#   1 argument:  path of a ligand file
+#   return:  the index of the file (see buildLigandIndex), loaded from the
+#            saved index if it was made from the file as it is now, and
+#            otherwise built and saved
+
+def loadLigandIndex(path):
+    indexPath = path + ".idx.npz"
+    stat = os.stat(path)
+    fileId = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    if os.path.exists(indexPath):
+        with np.load(indexPath) as saved:
+            if np.array_equal(saved["fileId"], fileId):
+                return saved["offsets"], saved["lengths"]
+
+    offsets, lengths = buildLigandIndex(path)
+    # several processes may build the index at once, so each writes its own
+    # file and renames it into place
+    tmpPath = "{}.{}.tmp.npz".format(indexPath, os.getpid())
+    try:
+        np.savez(tmpPath, offsets=offsets, lengths=lengths, fileId=fileId)
+        os.replace(tmpPath, indexPath)
+    except OSError:
+        pass    # the index is only a time saver
+    return offsets, lengths
+
+# function openLigandSource
+#   1 argument:  the command line arguments
+#   return:  the ligand source they describe.  The ligands in
+#            args.ligandFile if one was given.  Otherwise, if
+#            args.nLigands <= 18, a pre-determined set of example ligands; otherwise args.nLigands
+#            random ligands whose length varies from 2 to args.maxLigand
+
+def openLigandSource(args):
+    if args.ligandFile is not None:
+        return FileLigands(args.ligandFile, args.mpiIO)
+    if args.nLigands <= 18:
+        return FixedLigands(EXAMPLE_LIGANDS[0:args.nLigands])
+    return RandomLigands(args.nLigands, args.maxLigand, args.seed)
+
+# function blockRange
+#   3 arguments:  number of items, number of parts and a part number
+#   return:  (start, stop) of that part when the items are split into
+#            consecutive parts whose sizes differ by at most one
+
+def blockRange(nItems, nParts, part):
+    n, remainder = divmod(nItems, nParts)
+    start = part * n + min(part, remainder)
+    stop = start + n + (1 if part < remainder else 0)
+    return start, stop
@@ -10,8 +10,32 @@
 #  request another. This dynamic assignmnet means that if one ligand takes
 #  a worker a long time to compute, another worker can complete
 #  additional ones that might take less time.
-#  In this version, the master is keeping track of the overall
-#  maximum scoring ligands.
+#  In this version, each worker keeps track of the maximum scoring
+#  ligands it has scored, and these are combined with a reduction at the end.
+#  With --schedule guided the master instead sends batches of ligands,
+#  starting with large batches and sending smaller ones as the list runs
+#  out (guided self-scheduling), which cuts the number of messages.
+#  With --prefetch the master keeps extra batches queued at each worker,
+#  using nonblocking sends and receives, so workers do not sit idle while
+#  their result travels to the master and the next batch comes back.
+#  With --shared-counter there is no master: all processes score ligands
+#  and claim new ones from a shared counter using MPI one-sided operations.
+#  With --result-log the master appends every score it receives to a log
+#  file, and a run started again with the same log only scores the
+#  ligands that are not in it yet.
+#  Batches of ligands are sent as packed byte buffers and scores come back
+#  as int32 arrays, using the uppercase buffer versions of the MPI calls;
+#  --transport pickle sends python lists instead, for comparison.
+#  With --hierarchical the master only talks to one leader process per
+#  node.  Each leader takes large batches from the master and hands out
+#  pieces of them to the other processes on its node, collecting their
+#  scores into one result for the master.
+#  With --jobs the processes stay running and screen one job after
+#  another, read from a file or a named pipe, so the time to start them is
+#  only spent once.
+#  With --pool each worker scores its batches with a pool of processes on
+#  its own node, so one worker per node can keep all the node's cores busy
+#  and the master has fewer workers to talk to.
 #
 #  To run a small example:
 #        mpirun -np 4 python ./dd_mpi_dynamic.py 18 -verbose
@@ -19,26 +43,121 @@
 #  To see all the options:
 #        python ./dd_mpi_dynamic.py --help
 
+import argparse
+import json
 import math
+import multiprocessing
+import os
+import shlex
+import stat
+import time
+from collections import deque
+import numpy as np
 from mpi4py import MPI
 
 # Functions in common between this and the 'equal chunks' version
 from dd_functions import *
+from dd_cache import *
 
 # tags that can be applied to messages
 WORKTAG = 1
 DIETAG = 2
+RESULTTAG = 3
+
+DFLT_minChunk = 1
+DFLT_claimSize = 8
+DFLT_prefetch = 0
+JOB_POLL_TIME = 0.05
+POOL_PIECES = 4
+
+# options used only by this version
+def addDynamicArguments(parser):
+    parser.add_argument('--schedule', choices=['single', 'guided'],
+        default='single',
+        help='single: one ligand per message; guided: batches of ligands '
+             'that shrink as the remaining work runs out')
+    parser.add_argument('--min-chunk', dest='minChunk', metavar='count',
+        type=int, default=DFLT_minChunk,
+        help='smallest batch of ligands sent with --schedule guided')
+    parser.add_argument('--sort-by-cost', dest='sortByCost',
+        action='store_true',
+        help='hand out the ligands with the highest estimated cost first')
+    parser.add_argument('--prefetch', metavar='depth', type=int,
+        default=DFLT_prefetch,
+        help='number of extra batches queued at each worker, so it never '
+             'waits for the master between batches')
+    parser.add_argument('--shared-counter', dest='sharedCounter',
+        action='store_true',
+        help='no master: every process, including 0, claims the next '
+             'ligands from a counter in an MPI window')
+    parser.add_argument('--claim-size', dest='claimSize', metavar='count',
+        type=int, default=DFLT_claimSize,
+        help='number of ligands claimed at a time with --shared-counter')
+    parser.add_argument('--result-log', dest='resultLog', metavar='file',
+        default=None,
+        help='append the scores to this log as they arrive; a run started '
+             'again with the same log skips the ligands already in it')
+    parser.add_argument('--transport', choices=['buffer', 'pickle'],
+        default='buffer',
+        help='buffer: ligands and scores are sent as packed numpy arrays; '
+             'pickle: as pickled python lists')
+    parser.add_argument('--hierarchical', action='store_true',
+        help='the master sends batches to one leader process per node, '
+             'which shares them out among the other processes on its node')
+    parser.add_argument('--node-size', dest='nodeSize', metavar='count',
+        type=int, default=None,
+        help='with --hierarchical, group the processes into nodes of this '
+             'many consecutive ranks instead of by machine (to try it on '
+             'one machine)')
+    parser.add_argument('--output', metavar='file', default=None,
+        help='also write the best ligands to this JSON file')
+    parser.add_argument('--jobs', metavar='file', default=None,
+        help='stay running and screen the jobs in this file or named pipe: '
+             'one line of options per job, which override the ones given '
+             'here; a line saying quit stops')
+    parser.add_argument('--pool', metavar='processes', type=int, default=None,
+        help='each worker scores its ligands with this many processes on '
+             'its node (0 for one per core) and is sent batches that many '
+             'times larger; run one worker per node')
 
 def main():
     # set up MPI and retrieve basic data
     comm = MPI.COMM_WORLD
-    id = comm.Get_rank()            #number of the process running the code
-    numProcesses = comm.Get_size()  #total number of processes running
     myHostName = MPI.Get_processor_name()  #machine name running the code
 
     start = MPI.Wtime() # start timer
 
-    args = getCommandLineArgs()
+    args = getCommandLineArgs(addDynamicArguments)
+
+    if args.jobs is not None:
+        serveJobs(comm, args, myHostName)
+    else:
+        screenOnce(comm, args, myHostName, start)
+
+#
+# Run one screen; called by every process.  Writes the best ligands to
+# args.output as well as printing them, if it was given.
+#
+def screenOnce(comm, args, myHostName, start):
+    id = comm.Get_rank()            #number of the process running the code
+    numProcesses = comm.Get_size()  #total number of processes running
+
+    if len(getProteins(args)) > 1:
+        if id == 0:
+            print("Use dd_mpi_equal_chunks.py to screen against several proteins")
+        return
+
+    timer = openPhaseTimer(comm, args)
+
+    if args.sharedCounter:
+        best = sharedCounterScreen(comm, args, myHostName, timer)
+        finish = MPI.Wtime()  # end the timing
+        proc_time = finish - start
+        print("Process {0:} running time: {1:12.3f} sec".format(id, proc_time))
+        if id == 0 and args.output is not None:
+            writeResults(args.output, args, best, proc_time)
+        timer.report(args.trace)
+        return
 
     if numProcesses <= 1:
         print("Need at least two processes, aborting")
@@ -52,95 +171,642 @@ def main():
         printIf(args.verbose, "master created {} ligands : \n{}".format(len(ligands), ligands), flush=True)
         printIf(args.verbose, "to be scored against protein: {}".format(args.protein), flush=True)
 
-        handOutWork(ligands, comm, numProcesses, args, myHostName)
+        if args.hierarchical:
+            localComm, leaderComm = splitByNode(comm, args)
+            printIf(args.verbose, "master has {} node leaders".format(leaderComm.Get_size()-1), flush=True)
+            messageCount, topK = handOutWork(ligands, leaderComm,
+                leaderComm.Get_size(), args, myHostName, timer)
+        else:
+            messageCount, topK = handOutWork(ligands, comm, numProcesses, args,
+                                             myHostName, timer)
+        stallTime = 0.0
+
+        # combine the best ligands found by every worker
+        with timer.phase("recv_wait"):
+            best = reduceTopK(comm, topK)
+        printTopK(best)
 
         finish = MPI.Wtime()  # end the timing
         total_time = finish - start
         # print("Total Running time: {0:12.3f} sec".format(total_time))
         print("Total Running time: {0:12.3f} sec".format(total_time))
+        if args.output is not None:
+            writeResults(args.output, args, best, total_time)
 
     else:
-        worker(comm, args, myHostName)
+        if not args.hierarchical:
+            stallTime, topK = worker(comm, args, myHostName, timer)
+        else:
+            localComm, leaderComm = splitByNode(comm, args)
+            if leaderComm == MPI.COMM_NULL:
+                stallTime, topK = teamWorker(localComm, args, timer)
+            else:
+                team = NodeTeam(localComm) if localComm.Get_size() > 1 else None
+                stallTime, topK = worker(leaderComm, args, myHostName, timer, team)
+        with timer.phase("send"):
+            reduceTopK(comm, topK)
 
         finish = MPI.Wtime()  # end the timing
         proc_time = finish - start
         print("Process {0:} running time: {1:12.3f} sec".format(id, proc_time))
 
+    # the master reports how long each worker waited for work
+    stallTimes = comm.gather(stallTime, root=0)
+    if id == 0:
+        print("Messages sent by master: {}".format(messageCount))
+        for w in range(1, numProcesses):
+            print("Worker {0:} stall time: {1:12.3f} sec".format(w, stallTimes[w]))
+    timer.report(args.trace)
+
+# function writeResults
+#   4 arguments:  name of a JSON file, the command line arguments, the TopK
+#                 of the best ligands and the running time
+#   state change:  writes the protein, the best scores with their ligands
+#                  and the time to the file
+
+def writeResults(path, args, best, seconds):
+    with open(path, "w") as f:
+        json.dump({"protein": args.protein, "nLigands": args.nLigands,
+                   "ligandFile": args.ligandFile, "top": args.top,
+                   "best": best.best(), "seconds": seconds}, f, indent=1)
+
+# function readJobs
+#   1 argument:  name of a jobs file, or of a named pipe (FIFO)
+#   return:  generator of the lines in it that are not blank or comments,
+#            up to a line that says quit
+#
+# A named pipe is opened again each time the program writing to it
+# closes it, so jobs can be sent to it one after another.
+
+def readJobs(path):
+    while True:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line == "quit":
+                    return
+                if line and not line.startswith("#"):
+                    yield line
+        if not stat.S_ISFIFO(os.stat(path).st_mode):
+            return
+
+# function numberedPath
+#   2 arguments:  a file name and a number
+#   return:  the file name with the number put before its extension
+
+def numberedPath(path, number):
+    root, extension = os.path.splitext(path)
+    return "{}.{}{}".format(root, number, extension)
+
+#
+# With --jobs, the processes stay running and screen one job after
+# another.  Each line of the jobs file holds the options of one job, just
+# as they would be given on the command line; options it does not give
+# keep the values given when the program was started.  The master reads
+# the jobs and sends each one to every process.  While the master waits for
+# a job, the others wait in a nonblocking barrier that they check now and
+# then, so they do not use the CPU.
+#
+def serveJobs(comm, args, myHostName):
+    id = comm.Get_rank()
+    jobs = readJobs(args.jobs) if id == 0 else None
+    jobCount = 0
+    while True:
+        job = None
+        if id == 0:
+            for line in jobs:
+                earlier = argparse.Namespace(**vars(args))
+                earlier.output = None
+                try:
+                    job = getCommandLineArgs(addDynamicArguments,
+                        shlex.split(line), earlier)
+                except SystemExit:
+                    print("Skipping job with bad options:", line, flush=True)
+                    continue
+                # an --output given at the start gets the job number, so
+                # each job writes its own file
+                if job.output is None and args.output is not None:
+                    job.output = numberedPath(args.output, jobCount + 1)
+                break
+        ready = comm.Ibarrier()
+        while not ready.Test():
+            time.sleep(JOB_POLL_TIME)
+        job = comm.bcast(job, root=0)
+        if job is None:
+            return
+        jobCount += 1
+        if id == 0:
+            print("Job {}: {}".format(jobCount, line), flush=True)
+        screenOnce(comm, job, myHostName, MPI.Wtime())
+        if id == 0:
+            print(flush=True)
+
+# function nextBatch
+#   returns the next list of ligands to send to a worker, starting at
+#   ligands[workcount].  The guided schedule sends a share of the remaining
+#   ligands that shrinks as the list runs out, but never fewer than
+#   args.minChunk, so that workers finish at about the same time.
+#   numCores is the number of processes scoring in all the workers, and
+#   poolSize the number in the worker the batch is for, which gets a batch
+#   that many times larger.  If costs, the running totals of the estimated
+#   costs of the ligands, is given, the share is of the remaining cost
+#   instead of the remaining ligands.
+
+def nextBatch(ligands, workcount, numCores, args, poolSize=1, costs=None):
+    if args.schedule == 'guided' and costs is not None:
+        size = int(guidedCostChunkSize(costs, workcount, numCores / poolSize,
+                                       args.minChunk * poolSize))
+    elif args.schedule == 'guided':
+        remaining = len(ligands) - workcount
+        size = guidedChunkSize(remaining, numCores, args.minChunk) * poolSize
+    else:
+        size = poolSize
+    return ligands[workcount:workcount+size]
+
+# Upper bound on the size in bytes of a pickled list of nItems ligands of at
+# most itemBytes bytes each (or of nItems small ints, with itemBytes 0).
+# Nonblocking receives of pickled messages need a buffer at least this big.
+def pickledSizeBound(nItems, itemBytes=0):
+    return 64 + nItems * (itemBytes + 16)
+
+def handOutWork(ligands, comm, numProcesses, args, myHostName, timer):
+    # only send out distinct ligands whose score is not already known
+    cache = openScoreCache(args)
+    ligands, known = splitByCache(ligands, args.protein, cache)
+    printIf(args.verbose, "master will send {} ligands, {} scores found in cache"\
+    .format(len(ligands), len(known)), flush=True)
+
+    # ligands scored by an earlier run with the same log are not sent again
+    log = None
+    if args.resultLog is not None:
+        log = ResultLog(args.resultLog, args.protein)
+        logged = log.load()
+        resumed = [lig for lig in ligands if lig in logged]
+        known.update([(lig, logged[lig]) for lig in resumed])
+        ligands = [lig for lig in ligands if lig not in logged]
+        print("Ligands already scored in {}: {}".format(args.resultLog,
+                                                         len(resumed)))
+
+    # the longest ligands take the most time, so start them first
+    if args.sortByCost:
+        ligands.sort(key=lambda lig: estimateCost(lig, args.protein, args.scorer),
+                     reverse=True)
+    # sorted by cost, guided batches are sized by their share of the cost,
+    # or the first few workers would get most of the work
+    costs = None
+    if args.sortByCost and args.schedule == 'guided':
+        costs = costTotals(ligands, args.protein, args.scorer)
+
+    # how many processes each worker scores with (see --pool)
+    with timer.phase("recv_wait"):
+        poolSizes = comm.gather(0, root=0)
+    numCores = sum(poolSizes)
+    printIf(args.verbose, "master has {} workers with {} processes scoring"\
+    .format(numProcesses-1, numCores), flush=True)
+
+    # Tell the workers how big a batch message can be, so they can post
+    # receives ahead of time.  Batches counted in ligands never grow, so the
+    # first one is the largest; batches sized by cost grow as the ligands
+    # get cheaper, so the largest one that could be sent is found.
+    if costs is None:
+        maxBatch = len(nextBatch(ligands, 0, numCores, args, max(poolSizes)))
+    else:
+        maxBatch = int(guidedCostChunkSize(costs, np.arange(len(ligands)),
+            numCores / max(poolSizes), args.minChunk * max(poolSizes)).max(initial=0))
+    maxBytes = max([len(lig.encode()) for lig in ligands], default=0)
+    if args.transport == 'buffer':
+        bufferSize = batchSizeBound(maxBatch, maxBytes)
+    else:
+        bufferSize = pickledSizeBound(maxBatch, maxBytes)
+    with timer.phase("send"):
+        comm.bcast(bufferSize, root=0)
 
-def handOutWork(ligands, comm, numProcesses, args, myHostName):
     totalWork = len(ligands)
     workcount = 0
     recvcount = 0
-    # used to determine ligands with highest score
-    maxScore = -1
-    maxScoreLigands = []
+    messageCount = 0
+    # The workers keep track of the best ligands they score; the master
+    # only needs to add the ones whose score was already in the cache.
+    topK = TopK(args.top)
+    for lig, score in known.items():
+        topK.add(score, lig)
+
+    # With --prune, the best score needed to matter so far.  It is sent with
+    # every batch, and each worker sends back the one it knows about.
+    threshold = pruneThreshold(args, topK)
+    prunedCount = 0
+
+    # Batches sent to each worker and not yet answered, oldest first.  Each
+    # worker answers its batches in order, so only the score list comes back.
+    pending = [deque() for id in range(numProcesses)]
+    # the receive posted for each worker's next result, and with buffer
+    # transport the array it arrives in
+    resultRequests = [MPI.REQUEST_NULL] * numProcesses
+    resultBuffers = [None] * numProcesses
+    # sends that may not have finished, and with buffer transport their
+    # messages, which must not be freed until they have
+    sendRequests = []
+    sendBuffers = []
+
+    # forget the sends that have finished, so the lists stay about as long
+    # as the number of batches in flight instead of growing with every one
+    def reapSends():
+        nonlocal sendRequests, sendBuffers
+        done = MPI.Request.Testsome(sendRequests)
+        if done:
+            done = set(done)
+            sendRequests = [r for i, r in enumerate(sendRequests) if i not in done]
+            sendBuffers = [b for i, b in enumerate(sendBuffers) if i not in done]
+
+    def postResultReceive(id):
+        nItems = len(pending[id][0])
+        if args.transport == 'buffer':
+            resultBuffers[id] = np.empty(1 + nItems, dtype=np.int32)
+            resultRequests[id] = comm.Irecv([resultBuffers[id], MPI.INT],
+                                            source=id, tag=RESULTTAG)
+        else:
+            buf = bytearray(pickledSizeBound(nItems))
+            resultRequests[id] = comm.irecv(buf, source=id, tag=RESULTTAG)
+
+    # return the id of the next worker to send results, its threshold and
+    # its scores
+    def receiveResults():
+        if args.transport == 'buffer':
+            id = MPI.Request.Waitany(resultRequests)
+            results = resultBuffers[id]
+            return id, int(results[0]), results[1:].tolist()
+        id, results = MPI.Request.waitany(resultRequests)
+        return id, results[0], results[1]
+
+    def sendBatch(id):
+        nonlocal workcount, messageCount
+        work = nextBatch(ligands, workcount, numCores, args, poolSizes[id],
+                         costs)
+        with timer.phase("send"):
+            reapSends()
+            if args.transport == 'buffer':
+                message = packBatch(threshold, work)
+                sendRequests.append(comm.Isend([message, MPI.BYTE], dest=id,
+                                               tag=WORKTAG))
+            else:
+                message = None      # the request keeps the pickled message
+                sendRequests.append(comm.isend([threshold, work], dest=id,
+                                               tag=WORKTAG))
+            sendBuffers.append(message)
+        workcount += len(work)
+        messageCount += 1
+        pending[id].append(work)
+        if resultRequests[id] == MPI.REQUEST_NULL:
+            postResultReceive(id)
+        printIf(args.verbose,"master on {} sent {} to {}".format(myHostName, work, id), flush=True)
 
     printIf(args.verbose, "master sending first tasks", flush=True)
-    # send out the first tasks to all workers
-    for id in range(1, numProcesses):
-        if workcount < totalWork:
-            work=ligands[workcount]
-            comm.send(work, dest=id, tag=WORKTAG)
-            workcount += 1
-            printIf(args.verbose,"master on {} sent {} to {}".format(myHostName, work, id), flush=True)
-
-    # while there is still work,
-    # receive result from a worker, which also
-    # signals they would like some new work
-    while (workcount < totalWork) :
-        results, workerId = masterReceiveResults(comm, args)
-        score = results[0]
-        lig = results[1]
-        recvcount += 1
+    # send out the first tasks to all workers: one to work on, and
+    # args.prefetch more waiting in line behind it
+    for depth in range(args.prefetch + 1):
+        for id in range(1, numProcesses):
+            if workcount < totalWork:
+                sendBatch(id)
+
+    # receive results from whichever worker finishes first,
+    # and send it more work if there is still some
+    while (recvcount < totalWork) :
+        with timer.phase("recv_wait"):
+            id, workerThreshold, scores = receiveResults()
+        resultRequests[id] = MPI.REQUEST_NULL
+        threshold = max(threshold, workerThreshold)
+        ligs = pending[id].popleft()
+        recvcount += len(ligs)
+        printIf(args.verbose, "master received {} with score {} from {}"\
+        .format(ligs, scores, id), flush=True)
+        if pending[id]:
+            postResultReceive(id)
 
         #send next work
-        work=ligands[workcount]
-        comm.send(work, dest=workerId, tag=WORKTAG)
-        workcount += 1
-        printIf(args.verbose,"master on {} sent {} to {}".format(myHostName, work, workerId), flush=True)
+        if workcount < totalWork:
+            sendBatch(id)
 
-        # keep track of maximum
-        maxScore, maxScoreLigands = updateMaximum(score, lig, maxScore, maxScoreLigands)
+        scoredLigs = []
+        scoredScores = []
+        for score, lig in zip(scores, ligs):
+            if score >= 0:
+                cache.put(args.protein, lig, score)
+                scoredLigs.append(lig)
+                scoredScores.append(score)
+            else:
+                prunedCount += 1
+        if log is not None:
+            log.add(scoredLigs, scoredScores)
 
+    # Tell all workers to stop
+    with timer.phase("send"):
+        for id in range(1, numProcesses):
+            if args.transport == 'buffer':
+                sendRequests.append(comm.Isend([b"", MPI.BYTE], dest=id,
+                                               tag=DIETAG))
+            else:
+                sendRequests.append(comm.isend(-1, dest=id, tag=DIETAG))
+            sendBuffers.append(None)
+            messageCount += 1
+        MPI.Request.waitall(sendRequests)
 
-    # Receive results for outstanding work requests.
-    while (recvcount < totalWork):
-        results, workerId = masterReceiveResults(comm, args)
-        score = results[0]
-        lig = results[1]
-        recvcount += 1
+    if log is not None:
+        log.close()
+    cache.save()
+    if args.prune:
+        print("Ligands pruned: {}".format(prunedCount))
+    return messageCount, topK
 
-        # keep track of maximum
-        maxScore, maxScoreLigands = updateMaximum(score, lig, maxScore, maxScoreLigands)
 
-    # Tell all workers to stop
-    for id in range(1, numProcesses):
-        comm.send(-1, dest=id, tag=DIETAG)
 
-    # print results
-    print('The maximum score is', maxScore)
-    print('Achieved by ligand(s)', maxScoreLigands)
+#
+# Masterless version: every process scores ligands.  The index of the next
+# ligand to be scored is kept in an MPI window on process 0, and each process
+# claims the next args.claimSize ligands with an atomic fetch-and-add on it,
+# so no process has to wait for a master to answer.  The ligand list is sent
+# to everyone at the start, or with --generate-locally each process makes
+# the ligands it claims.  The best ligands are found at the end with a
+# reduction.
+#
+def sharedCounterScreen(comm, args, myHostName, timer):
+    id = comm.Get_rank()
+    # the saved cache needs the list of ligands on process 0
+    useCache = args.cacheFile is not None and not args.generateLocally
+    known = {}
+    if args.generateLocally:
+        # every process makes the ligands it claims, so none are sent
+        ligands = openLigandSource(args)
+    else:
+        if id == 0:
+            ligands = genLigandList(args)
+            printIf(args.verbose, "process 0 created {} ligands : \n{}".format(len(ligands), ligands), flush=True)
+            cache = openScoreCache(args)
+            ligands, known = splitByCache(ligands, args.protein, cache)
+        else:
+            ligands = None
+        with timer.phase("send" if id == 0 else "recv_wait"):
+            ligands = FixedLigands(comm.bcast(ligands, root=0))
+
+    # the shared counter is one 8-byte integer in a window on process 0
+    itemSize = MPI.INT64_T.Get_size()
+    win = MPI.Win.Allocate(itemSize if id == 0 else 0, itemSize, comm=comm)
+    if id == 0:
+        np.frombuffer(win.tomemory(), dtype=np.int64)[0] = 0
+    comm.Barrier()
 
+    topK = TopK(args.top)
+    for lig, score in known.items():
+        topK.add(score, lig)
+    scored = {}
+    prunedCount = 0
+    claim = np.array([args.claimSize], dtype=np.int64)
+    first = np.zeros(1, dtype=np.int64)
+    while True:
+        with timer.phase("recv_wait"):
+            win.Lock(0, MPI.LOCK_SHARED)
+            win.Fetch_and_op(claim, first, target_rank=0, op=MPI.SUM)
+            win.Unlock(0)
+        start = int(first[0])
+        if start >= len(ligands):
+            break
+        with timer.phase("compute"):
+            work = ligands.getRange(start, start+args.claimSize)
+            printIf(args.verbose, "process {} on {} claimed {}".format(id, myHostName, work), flush=True)
+            scores = scoreLigands(work, args.protein, args.scorer,
+                                  pruneThreshold(args, topK))
+            topK.addAll(scores, work)
+        prunedCount += int((scores < 0).sum())
+        if useCache:
+            scored.update([(lig, score) for lig, score in zip(work, scores.tolist())
+                           if score >= 0])
+    win.Free()
+    ligands.close()
 
+    with timer.phase(collectivePhase(comm)):
+        best = reduceTopK(comm, topK)
+        prunedCount = comm.reduce(prunedCount, op=MPI.SUM, root=0)
+        # the saved cache needs every score, so only collect them if it is used
+        if useCache:
+            allScored = comm.gather(scored, root=0)
+    if id == 0:
+        if useCache:
+            for part in allScored:
+                for lig, score in part.items():
+                    cache.put(args.protein, lig, score)
+            cache.save()
+        printTopK(best)
+        if args.prune:
+            print("Ligands pruned: {}".format(prunedCount))
+    return best
 
+# function openWorkerPool
+#   1 argument:  the command line arguments
+#   return:  a pool of args.pool processes (one per core if it is 0) and its
+#            size, or None and 1 if --pool was not given
 #
-# Actions of the worker: receive ligand, compute score, and return them
+# The pool processes are forked, so they have all the scoring functions
+# already and never make MPI calls themselves.
+
+def openWorkerPool(args):
+    if args.pool is None:
+        return None, 1
+    poolSize = args.pool if args.pool > 0 else os.cpu_count()
+    return multiprocessing.get_context("fork").Pool(poolSize), poolSize
+
+# function scoreLigandsInPool
+#   6 arguments:  a pool from openWorkerPool and its size, a list of ligands,
+#                 a protein, a scorer name and a pruning threshold
+#   return:  numpy array of the score of each ligand, as from scoreLigands
 #
-def worker(comm, args, myHostName):
+# The ligands are split into POOL_PIECES pieces per pool process, so one
+# piece with slow ligands in it does not hold up the others for long.
+
+def scoreLigandsInPool(pool, poolSize, ligands, pro, scorerName, threshold=-1):
+    if pool is None or len(ligands) < 2:
+        return scoreLigands(ligands, pro, scorerName, threshold)
+    nPieces = min(len(ligands), POOL_PIECES * poolSize)
+    pieces = [(ligands[slice(*blockRange(len(ligands), nPieces, p))], pro,
+               scorerName, threshold) for p in range(nPieces)]
+    return np.concatenate(pool.starmap(scoreLigands, pieces, chunksize=1))
+
+# function splitByNode
+#   2 arguments:  the communicator of all the processes and the command
+#                 line arguments
+#   return:  a communicator of the processes on this process's node, and
+#            one of the master and the node leaders (MPI.COMM_NULL on the
+#            other processes)
+#
+# The nodes are the shared-memory machines, or groups of args.nodeSize
+# consecutive ranks.  The master is kept out of its node's group, so the
+# leader of every node is the lowest other rank on it.
+
+def splitByNode(comm, args):
+    id = comm.Get_rank()
+    if args.nodeSize is not None:
+        nodeComm = comm.Split(max(id-1, 0) // args.nodeSize, id)
+    else:
+        nodeComm = comm.Split_type(MPI.COMM_TYPE_SHARED, key=id)
+    localComm = nodeComm.Split(0 if id == 0 else 1, id)
+    nodeComm.Free()
+    isLeader = id == 0 or localComm.Get_rank() == 0
+    leaderComm = comm.Split(0 if isLeader else MPI.UNDEFINED, id)
+    return localComm, leaderComm
+
+class NodeTeam:
+    # The processes on a node other than its leader.  The leader uses them
+    # in place of scoring a batch itself: it splits the batch into
+    # POOL_PIECES pieces per process and hands them out dynamically.
+
+    def __init__(self, localComm):
+        self.comm = localComm
+        self.size = localComm.Get_size() - 1
+
+    # return numpy array of the score of each ligand, as from scoreLigands
+    def score(self, ligands, threshold):
+        nPieces = max(1, min(len(ligands), POOL_PIECES * self.size))
+        pieces = [blockRange(len(ligands), nPieces, p) for p in range(nPieces)]
+        scores = np.empty(len(ligands), dtype=np.int32)
+        requests = [MPI.REQUEST_NULL] * (self.size + 1)
+        working = [None] * (self.size + 1)   # piece each member is scoring
+        messages = []
+        nextPiece = 0
+
+        def sendPiece(member):
+            nonlocal nextPiece
+            first, last = pieces[nextPiece]
+            messages.append(packBatch(threshold, ligands[first:last]))
+            self.comm.Isend([messages[-1], MPI.BYTE], dest=member, tag=WORKTAG)\
+                .Free()
+            requests[member] = self.comm.Irecv([scores[first:last], MPI.INT],
+                                               source=member, tag=RESULTTAG)
+            working[member] = nextPiece
+            nextPiece += 1
+
+        for member in range(1, self.size + 1):
+            if nextPiece < nPieces:
+                sendPiece(member)
+        while True:
+            member = MPI.Request.Waitany(requests)
+            if member == MPI.UNDEFINED:
+                return scores
+            if nextPiece < nPieces:
+                sendPiece(member)
+
+    # tell the members to stop
+    def close(self):
+        for member in range(1, self.size + 1):
+            self.comm.Send([b"", MPI.BYTE], dest=member, tag=DIETAG)
+
+#
+# Actions of a process on a node with --hierarchical, other than the
+# leader: score the pieces of batches the leader sends, until told to stop.
+# Returns the time spent waiting for pieces, and an empty TopK, since the
+# leader keeps track of the best ligands.
+#
+def teamWorker(localComm, args, timer):
+    stallTime = 0.0
+    pool, poolSize = openWorkerPool(args)
+    while True:
+        stat = MPI.Status()
+        waitStart = MPI.Wtime()
+        localComm.Probe(source=0, tag=MPI.ANY_TAG, status=stat)
+        message = np.empty(stat.Get_count(MPI.BYTE), dtype=np.uint8)
+        localComm.Recv([message, MPI.BYTE], source=0, tag=stat.Get_tag())
+        waitEnd = MPI.Wtime()
+        stallTime += waitEnd - waitStart
+        timer.add("recv_wait", waitStart, waitEnd)
+        if stat.Get_tag() == DIETAG:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            return stallTime, TopK(args.top)
+        threshold, ligands = unpackBatch(message)
+        with timer.phase("compute"):
+            scores = scoreLigandsInPool(pool, poolSize, ligands, args.protein,
+                                        args.scorer, threshold)
+        with timer.phase("send"):
+            localComm.Send([scores.astype(np.int32), MPI.INT], dest=0, tag=RESULTTAG)
+
+#
+# Actions of the worker: receive ligands, compute scores, and return them.
+# The receive for the next batch is posted before scoring the current one,
+# so a batch the master sends ahead arrives while this one is being scored.
+# Returns the time spent stalled waiting for work to arrive, and the best
+# ligands this worker scored.  A node leader with --hierarchical is given
+# the NodeTeam of the other processes on its node, which score for it.
+#
+def worker(comm, args, myHostName, timer, team=None):
+    stallTime = 0.0
+    topK = TopK(args.top)
+    if team is None:
+        pool, poolSize = openWorkerPool(args)
+    else:
+        pool, poolSize = None, team.size
+    with timer.phase("send"):
+        comm.gather(poolSize, root=0)
+    with timer.phase("recv_wait"):
+        bufferSize = comm.bcast(None, root=0)
+
+    # post the receive for the next batch; with buffer transport the batch
+    # is always received into the same array, once the last one is unpacked
+    receiveBuffer = np.empty(bufferSize, dtype=np.uint8)
+    def postWorkReceive():
+        if args.transport == 'buffer':
+            return comm.Irecv([receiveBuffer, MPI.BYTE], source=0, tag=MPI.ANY_TAG)
+        return comm.irecv(bytearray(bufferSize), source=0, tag=MPI.ANY_TAG)
+
+    request = postWorkReceive()
+    sendRequest = MPI.REQUEST_NULL
     # keep receiving messages and do work, unless tagged to 'die'
     while(True):
         stat = MPI.Status()
-        nextLigand = comm.recv(source=0, tag=MPI.ANY_TAG, status=stat)
-        printIf(args.verbose, "worker {} on {} got {}".format(comm.Get_rank(), myHostName, nextLigand), flush=True)
+        waitStart = MPI.Wtime()
+        if args.transport == 'buffer':
+            request.Wait(status=stat)
+        else:
+            message = request.wait(status=stat)
+        waitEnd = MPI.Wtime()
+        stallTime += waitEnd - waitStart
+        timer.add("recv_wait", waitStart, waitEnd)
         # stop if message has special tag
         if (stat.Get_tag() == DIETAG):
             printIf(args.verbose, "worker {} dying".format(comm.Get_rank()), flush=True)
-            return
-        # do work of scoring the ligand
-        s = score(nextLigand, args.protein)
+            with timer.phase("send"):
+                sendRequest.wait()
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if team is not None:
+                team.close()
+            return stallTime, topK
+        if args.transport == 'buffer':
+            message = unpackBatch(receiveBuffer[:stat.Get_count(MPI.BYTE)])
+        masterThreshold, nextLigands = message
+        request = postWorkReceive()
+        printIf(args.verbose, "worker {} on {} got {}".format(comm.Get_rank(), myHostName, nextLigands), flush=True)
+        # do work of scoring the ligands, skipping any that cannot beat
+        # the best scores known here or to the master
+        threshold = max(masterThreshold, pruneThreshold(args, topK))
+        if team is not None:
+            with timer.phase("recv_wait"):
+                scores = team.score(nextLigands, threshold)
+        else:
+            with timer.phase("compute"):
+                scores = scoreLigandsInPool(pool, poolSize, nextLigands,
+                                            args.protein, args.scorer, threshold)
+        topK.addAll(scores, nextLigands)
         # indicate done with work by sending to Master
-        result = [s, nextLigand]
-        comm.send(result, dest=0)
+        with timer.phase("send"):
+            sendRequest.wait()
+            if args.transport == 'buffer':
+                result = np.empty(1 + len(scores), dtype=np.int32)
+                result[0] = pruneThreshold(args, topK)
+                result[1:] = scores
+                sendRequest = comm.Isend([result, MPI.INT], dest=0, tag=RESULTTAG)
+            else:
+                result = [pruneThreshold(args, topK), scores.tolist()]
+                sendRequest = comm.isend(result, dest=0, tag=RESULTTAG)
 
 ########## Run the main function
-main()
+if __name__ == "__main__":
+    main()
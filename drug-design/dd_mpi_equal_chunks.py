@@ -5,9 +5,12 @@
 #  pattern.  The master generates a list of ligands to be matched to
 #  a given protein and scored based on simple matching of letters.
 #  Each worker gets assigned an equal number of ligands from the list and
-#  computes a score for each one, sending it back to the master.
-#  In this version, the master is keeping track of the overall
-#  maximum scoring ligands.
+#  computes a score for each one, keeping track of the maximum scoring
+#  ligands.  The best ligands of all the workers are combined with a
+#  reduction at the end.
+#
+#  Given several proteins (--proteins or --protein-file), it screens the
+#  ligands against all of them; see dd_panel.py.
 #
 #  To run a small example:
 #        mpirun -np 4 python ./dd_mpi_equal_chunks.py 18 -verbose
@@ -15,11 +18,12 @@
 #  To see all the options:
 #       python dd_mpi_equal_chunks.py --help
 
-import math
 from mpi4py import MPI
 
 # Functions in common between this and the 'dynamic' version
 from dd_functions import *
+from dd_cache import *
+from dd_panel import panelScreen
 
 
 # main program
@@ -33,12 +37,24 @@ def main():
 
     start = MPI.Wtime() # start timer
 
-    args = getCommandLineArgs()
+    args = getCommandLineArgs(addEqualChunksArguments)
 
     if numProcesses <= 1:
         print("Need at least two processes, aborting")
         return
 
+    timer = openPhaseTimer(comm, args)
+
+    if len(getProteins(args)) > 1:
+        panelScreen(comm, args, start, timer)
+        timer.report(args.trace)
+        return
+
+    if args.generateLocally:
+        localLigandsScreen(comm, args, start, timer)
+        timer.report(args.trace)
+        return
+
     # if ((args.nLigands%(numProcesses-1)) != 0):
     #     print("Number of ligands should be divisible by number of worker processes. Exiting")
     #     exit()
@@ -52,67 +68,161 @@ def main():
         printIf(args.verbose, "master created {} ligands : \n{}".format(len(ligands), ligands), flush=True)
         printIf(args.verbose, "to be scored against protein: {}".format(args.protein), flush=True)
 
-        totalWork = len(ligands)
-        recvcount = 0  # number of ligand scores from workers
+        # only send out distinct ligands whose score is not already known
+        cache = openScoreCache(args)
+        ligands, known = splitByCache(ligands, args.protein, cache)
+        printIf(args.verbose, "master will send {} ligands, {} scores found in cache"\
+        .format(len(ligands), len(known)), flush=True)
 
-        # used to determine ligands with highest score
-        maxScore = -1
-        maxScoreLigands = []
+        # the master only adds the ligands whose score was in the cache
+        topK = TopK(args.top)
+        for lig, score in known.items():
+            topK.add(score, lig)
 
         ######################## send chunks to workers
-        # workers will get as equal chunks as possible, differing by 1
-        #
-        # ligands per worker
-        n = math.ceil(len(ligands)/(numProcesses-1))
-        printIf(args.verbose, "Each worker process will do at most {} ligands".format(n), flush=True)
-
-        remainder = args.nLigands%(numProcesses-1)
-
-        # the workers who will get n ligands (rest will get n-1)
-        if (remainder == 0):
-            n_workers = numProcesses
-        else:
-            n_workers = remainder + 1
-        # send n to these workers
-        for p in range(1, n_workers):
-            comm.send(ligands[(p-1)*n:p*n], dest=p)
-        # send n-1 to the rest of the workers
-        for p in range(n_workers, numProcesses):
-            comm.send(ligands[(p-1)*(n-1):p*(n-1)], dest=p)
+        # each worker gets the ligands in one part; the master scores none
+        parts = partitionLigands(ligands, numProcesses-1, args.protein,
+                                 args.scorer, args.partition)
+        chunks = [[]] + [[ligands[i] for i in part] for part in parts]
+        predicted = [0] + [sum([estimateCost(lig, args.protein, args.scorer)
+                                for lig in chunk]) for chunk in chunks[1:]]
+        printIf(args.verbose, "Each worker process will do at most {} ligands"\
+        .format(max([len(part) for part in parts])), flush=True)
+        with timer.phase("send"):
+            scatterLigands(comm, chunks)
         ############################################ end of send chunks
 
-        # get a score for a ligand from each worker until all completed
-        while (recvcount < totalWork) :
-            results, workerId = masterReceiveResults(comm, args)
-            rcv_score = results[0]
-            lig = results[1]
-            recvcount += 1
-
-            # keep track of maximum
-            maxScore, maxScoreLigands = updateMaximum(rcv_score, lig, maxScore, maxScoreLigands)
+        # combine the best ligands found by every worker
+        with timer.phase("recv_wait"):
+            best = reduceTopK(comm, topK)
+            prunedCount = comm.reduce(0, op=MPI.SUM, root=0)
+        printTopK(best)
+        if args.prune:
+            print("Ligands pruned: {}".format(prunedCount))
+
+        # the saved cache needs every score, so only collect them if it is used
+        if args.cacheFile is not None:
+            with timer.phase("recv_wait"):
+                scores = gatherScores(comm, [], [len(chunk) for chunk in chunks])
+            allLigands = [lig for chunk in chunks for lig in chunk]
+            for lig, score in zip(allLigands, scores.tolist()):
+                if score >= 0:
+                    cache.put(args.protein, lig, score)
+            cache.save()
 
-        # print results
-        print('The maximum score is', maxScore)
-        print('Achieved by ligand(s)', maxScoreLigands)
         finish = MPI.Wtime()  # end the timing
         total_time = finish - start
         print("Total Running time: {0:12.3f} sec".format(total_time))
+        computeTime = 0.0
 
     else:       # worker
 
-        ligandList = comm.recv(source=0)
+        with timer.phase("recv_wait"):
+            ligandList = scatterLigands(comm, None)
 
         printIf(args.verbose, "Process {} ligandList: {}".format(id, ligandList), flush=True)
 
-        for lig in ligandList:
-            s = score(lig, args.protein)
-            result = [s, lig]
-            comm.send(result, dest=0)
+        # keep only the best ligands; they are combined with a reduction,
+        # so each worker sends one message instead of one per ligand
+        topK = TopK(args.top)
+        computeStart = MPI.Wtime()
+        scores = scoreIntoTopK(ligandList, args, topK)
+        computeEnd = MPI.Wtime()
+        computeTime = computeEnd - computeStart
+        timer.add("compute", computeStart, computeEnd)
+
+        printIf(args.verbose, "Process {} best ligands: {}".format(id, topK.best()), flush=True)
+        with timer.phase("send"):
+            reduceTopK(comm, topK)
+            comm.reduce(int((scores < 0).sum()), op=MPI.SUM, root=0)
+            if args.cacheFile is not None:
+                gatherScores(comm, scores, None)
 
         finish = MPI.Wtime()  # end the timing
         proc_time = finish - start
         print("Process {0:} running time: {1:12.3f} sec".format(id, proc_time))
 
+    # compare the share of the work each worker was predicted to get
+    # with the share of the scoring time it actually took
+    computeTimes = comm.gather(computeTime, root=0)
+    if id == 0:
+        printLoadSummary(predicted, computeTimes)
+    timer.report(args.trace)
 
-
-main()
+#
+# With --generate-locally nothing is sent to the workers: each one makes its
+# own block of consecutive ligands, one generator block at a time, so the
+# whole list never has to be in any one process's memory.
+#
+def localLigandsScreen(comm, args, start, timer):
+    id = comm.Get_rank()
+    numProcesses = comm.Get_size()
+    source = openLigandSource(args)
+    topK = TopK(args.top)
+    computeTime = 0.0
+    prunedCount = 0
+
+    if id != 0:
+        first, last = blockRange(len(source), numProcesses-1, id-1)
+        printIf(args.verbose, "Process {} makes ligands {} to {}".format(id, first, last-1), flush=True)
+        for ligandList in source.iterRange(first, last):
+            computeStart = MPI.Wtime()
+            scores = scoreIntoTopK(ligandList, args, topK)
+            computeEnd = MPI.Wtime()
+            computeTime += computeEnd - computeStart
+            timer.add("compute", computeStart, computeEnd)
+            prunedCount += int((scores < 0).sum())
+    source.close()
+
+    with timer.phase(collectivePhase(comm)):
+        best = reduceTopK(comm, topK)
+        prunedCount = comm.reduce(prunedCount, op=MPI.SUM, root=0)
+    finish = MPI.Wtime()  # end the timing
+    if id == 0:
+        printTopK(best)
+        if args.prune:
+            print("Ligands pruned: {}".format(prunedCount))
+        print("Total Running time: {0:12.3f} sec".format(finish - start))
+    else:
+        print("Process {0:} running time: {1:12.3f} sec".format(id, finish - start))
+
+    computeTimes = comm.gather(computeTime, root=0)
+    if id == 0:
+        printLoadSummary(None, computeTimes)
+
+# function printLoadSummary
+#   2 arguments:  estimated cost of each process's ligands (or None if it
+#                 was not estimated) and the time each process spent scoring
+#                 them (process 0 is the master)
+#   state change:  prints each worker's share of the predicted and actual load
+
+def printLoadSummary(predicted, computeTimes):
+    if predicted is None:
+        predicted = [0] * len(computeTimes)
+    totalPredicted = sum(predicted[1:])
+    totalTime = sum(computeTimes[1:])
+    print("Worker   predicted load   actual load   compute time")
+    for w in range(1, len(computeTimes)):
+        predictedShare = predicted[w] / totalPredicted if totalPredicted > 0 else 0.0
+        actualShare = computeTimes[w] / totalTime if totalTime > 0 else 0.0
+        print("{0:6}   {1:13.1%}   {2:11.1%}   {3:8.3f} sec"\
+        .format(w, predictedShare, actualShare, computeTimes[w]))
+    mean = totalTime / (len(computeTimes) - 1)
+    if mean > 0:
+        print("Load imbalance (max/mean compute time): {0:.2f}"\
+        .format(max(computeTimes[1:]) / mean))
+
+
+def addEqualChunksArguments(parser):
+    parser.add_argument('--partition', choices=['block', 'strided', 'lpt'],
+        default='block',
+        help='block: equal numbers of consecutive ligands; strided: every '
+             'n-th ligand; lpt: balance the estimated scoring cost')
+    parser.add_argument('--matrix-out', dest='matrixOut', metavar='file',
+        default=None,
+        help='with several proteins, write the ligand x protein scores to '
+             'this CSV file')
+
+
+if __name__ == "__main__":
+    main()
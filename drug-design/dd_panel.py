@@ -0,0 +1,132 @@
+# Screening one library of ligands against a panel of proteins.
+#
+#  Used by dd_mpi_equal_chunks.py when more than one protein is given.
+#  The work is a table with one row per ligand and one column per protein.
+#  It is split among the workers along its larger dimension: each worker
+#  scores a block of ligands against every protein, or, when there are
+#  more proteins than ligands, every ligand against a block of proteins.
+#  Ligands are scored a block at a time against all of a worker's proteins,
+#  so each block is still in cache while it is reused.
+
+import csv
+import numpy as np
+from mpi4py import MPI
+
+from dd_functions import *
+
+PANEL_BLOCK = 1024
+
+# function scorePanel
+#   3 arguments:  a list of ligands, a list of proteins and a scorer name
+#   return:  int32 numpy array with the score of ligand i against
+#            protein j in row i, column j
+
+def scorePanel(ligands, proteins, scorerName):
+    scores = np.zeros((len(ligands), len(proteins)), dtype=np.int32)
+    for start in range(0, len(ligands), PANEL_BLOCK):
+        block = ligands[start:start+PANEL_BLOCK]
+        stop = start + len(block)
+        if scorerName == "numpy":
+            packed = packLigandMatrix(block)
+        for p, pro in enumerate(proteins):
+            if scorerName == "numpy":
+                scores[start:stop, p] = scorePacked(packed, pro)
+            else:
+                scores[start:stop, p] = scoreLigands(block, pro, scorerName)
+    return scores
+
+# function writeScoreMatrix
+#   4 arguments:  name of a CSV file, the ligands, the proteins and the
+#                 matrix of scores from scorePanel
+#   state change:  writes one row per ligand, with a header row of proteins
+
+def writeScoreMatrix(path, ligands, proteins, scores):
+    with open(path, "w", newline="") as f:
+        out = csv.writer(f)
+        out.writerow(["ligand"] + proteins)
+        for lig, row in zip(ligands, scores.tolist()):
+            out.writerow([lig] + row)
+
+#
+# Run the whole panel screen; called by every process.  Process 0 is the
+# master and scores nothing.
+#
+def panelScreen(comm, args, start, timer):
+    id = comm.Get_rank()
+    numWorkers = comm.Get_size() - 1
+    proteins = getProteins(args)
+
+    # only the master needs the ligand list, unless workers make their own
+    ligands = None
+    if args.generateLocally:
+        source = openLigandSource(args)
+        nLigands = len(source)
+    else:
+        if id == 0:
+            ligands = list(dict.fromkeys(genLigandList(args)))   # no duplicates
+        nLigands = comm.bcast(len(ligands) if id == 0 else None, root=0)
+
+    # split along the larger dimension of the ligand x protein table
+    byLigands = nLigands >= len(proteins)
+    printIf(args.verbose and id == 0, "master splitting {} ligands x {} proteins by {}"\
+    .format(nLigands, len(proteins), "ligands" if byLigands else "proteins"), flush=True)
+
+    myLigands = []
+    myProteins = (0, 0)     # range of proteins this process scores
+    if byLigands:
+        if id != 0:
+            myProteins = (0, len(proteins))
+        if args.generateLocally:
+            if id != 0:
+                myLigands = source.getRange(*blockRange(nLigands, numWorkers, id-1))
+        elif id == 0:
+            chunks = [[]] + [ligands[slice(*blockRange(nLigands, numWorkers, w))]
+                             for w in range(numWorkers)]
+            with timer.phase("send"):
+                scatterLigands(comm, chunks)
+        else:
+            with timer.phase("recv_wait"):
+                myLigands = scatterLigands(comm, None)
+    else:
+        if args.generateLocally:
+            ligands = source.getRange(0, nLigands)
+        else:
+            with timer.phase("send" if id == 0 else "recv_wait"):
+                ligands = comm.bcast(ligands, root=0)
+        if id != 0:
+            myLigands = ligands
+            myProteins = blockRange(len(proteins), numWorkers, id-1)
+    if args.generateLocally:
+        source.close()
+
+    with timer.phase("compute"):
+        scores = scorePanel(myLigands, proteins[slice(*myProteins)], args.scorer)
+        topKs = [TopK(args.top) for pro in proteins]
+        for p in range(myProteins[1] - myProteins[0]):
+            topKs[myProteins[0] + p].addAll(scores[:, p], myLigands)
+
+    # the best ligands for each protein
+    with timer.phase(collectivePhase(comm)):
+        best = [reduceTopK(comm, topK) for topK in topKs]
+
+    # the whole table is only collected if it is written out
+    if args.matrixOut is not None:
+        with timer.phase(collectivePhase(comm)):
+            parts = comm.gather((myLigands if byLigands else None, scores), root=0)
+        if id == 0:
+            if byLigands:
+                ligands = [lig for part in parts[1:] for lig in part[0]]
+                matrix = np.vstack([part[1] for part in parts[1:]])
+            else:
+                matrix = np.hstack([part[1] for part in parts[1:]])
+            writeScoreMatrix(args.matrixOut, ligands, proteins, matrix)
+
+    if id == 0:
+        for pro, topK in zip(proteins, best):
+            print("Protein:", pro)
+            printTopK(topK)
+        finish = MPI.Wtime()  # end the timing
+        print("Total Running time: {0:12.3f} sec".format(finish - start))
+    else:
+        finish = MPI.Wtime()  # end the timing
+        print("Process {0:} running time: {1:12.3f} sec".format(id, finish - start))
@@ -0,0 +1,142 @@
+# Drug Design Exemplar:
+# Screening with an executor instead of mpirun
+#
+#  The other two versions are MPI programs: they must be started with
+#  mpirun and need at least two processes.  This version hands the ligands
+#  out in guided chunks (large at first, smaller as they run out) to any
+#  concurrent.futures executor, so the same screen can run:
+#    - on one machine, using all its cores, with a ProcessPoolExecutor:
+#        python dd_screen.py 10000
+#    - on a cluster with mpi4py's MPIPoolExecutor:
+#        mpirun -np 5 python -m mpi4py.futures dd_screen.py 10000 --executor mpi
+#
+#  It can also be used from other Python code:
+#        from dd_screen import makeExecutor, screen
+#        executor, workers = makeExecutor("process")
+#        with executor:
+#            topK, prunedCount = screen(ligands, protein, executor=executor,
+#                                       workers=workers)
+#        print(topK.best())
+#
+#  To see all the options:
+#        python dd_screen.py --help
+
+import os
+import time
+import concurrent.futures
+
+from dd_functions import *
+from dd_cache import *
+
+DFLT_executor = "process"
+EXECUTORS = ["process", "mpi", "serial"]
+
+# function makeExecutor
+#   2 arguments:  the kind of executor and the number of worker processes
+#                 (None for one per core, or as many as mpirun started)
+#       process:  concurrent.futures.ProcessPoolExecutor on this machine
+#       mpi:      mpi4py.futures.MPIPoolExecutor, whose workers are the
+#                 other MPI processes (or are spawned, if there are none)
+#       serial:   no executor; everything is scored in this process
+#   return:  the executor, or None for serial, and the number of processes
+#            it scores with
+
+def makeExecutor(kind=DFLT_executor, workers=None):
+    if kind == "process":
+        workers = workers or os.cpu_count() or 1
+        return concurrent.futures.ProcessPoolExecutor(workers), workers
+    if kind == "mpi":
+        from mpi4py.futures import MPIPoolExecutor
+        executor = MPIPoolExecutor(workers)
+        return executor, executor.num_workers
+    return None, 1
+
+# function screen
+#   8 arguments:  a list of ligands, a protein, a scorer name, the number
+#                 of best scores to report, an executor (or None to score
+#                 in this process), whether to prune, the smallest chunk,
+#                 and the number of processes the executor scores with
+#   return:  a TopK of the best ligands, and the number of ligands pruned
+#
+# Twice as many chunks as there are workers are kept in flight, so a worker
+# that finishes one always has another waiting.  With prune, each chunk is
+# given the threshold of the best scores known when it is handed out.
+
+def screen(ligands, pro, scorerName=DFLT_scorer, k=DFLT_top, executor=None,
+           prune=False, minChunk=1, workers=1):
+    topK = TopK(k)
+    prunedCount = 0
+    numWorkers = workers if executor is not None else 1
+    handedOut = 0
+
+    def nextChunk():
+        nonlocal handedOut
+        size = guidedChunkSize(len(ligands) - handedOut, numWorkers, minChunk)
+        chunk = ligands[handedOut:handedOut+size]
+        handedOut += len(chunk)
+        return (chunk, pro, scorerName, k, topK.threshold() if prune else -1)
+
+    if executor is None:
+        while handedOut < len(ligands):
+            chunkTopK, pruned = scoreChunk(*nextChunk())
+            topK.merge(chunkTopK)
+            prunedCount += pruned
+        return topK, prunedCount
+
+    running = set()
+    while handedOut < len(ligands) or running:
+        while handedOut < len(ligands) and len(running) < 2 * numWorkers:
+            running.add(executor.submit(scoreChunk, *nextChunk()))
+        done, running = concurrent.futures.wait(running,
+            return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            chunkTopK, pruned = future.result()
+            topK.merge(chunkTopK)
+            prunedCount += pruned
+    return topK, prunedCount
+
+# options used only by this version
+def addScreenArguments(parser):
+    parser.add_argument('--executor', choices=EXECUTORS,
+        default=DFLT_executor,
+        help='process: a pool of processes on this machine; mpi: the MPI '
+             'processes (run with mpirun ... python -m mpi4py.futures); '
+             'serial: just this process')
+    parser.add_argument('--workers', metavar='count', type=int, default=None,
+        help='number of worker processes (default: one per core, or every '
+             'MPI process but the first)')
+    parser.add_argument('--min-chunk', dest='minChunk', metavar='count',
+        type=int, default=1, help='smallest chunk of ligands handed out')
+
+def main():
+    start = time.perf_counter()
+    args = getCommandLineArgs(addScreenArguments)
+
+    # only distinct ligands whose score is not already known are scored;
+    # a --cache-file is read but not updated, since the workers only send
+    # back the best ligands
+    allLigands = genLigandList(args)
+    cache = openScoreCache(args)
+    executor, workers = makeExecutor(args.executor, args.workers)
+    try:
+        for pro in getProteins(args):
+            ligands, known = splitByCache(allLigands, pro, cache)
+            printIf(args.verbose, "{} ligands to score against {}, {} found in cache"\
+            .format(len(ligands), pro, len(known)), flush=True)
+            topK, prunedCount = screen(ligands, pro, args.scorer, args.top,
+                                       executor, args.prune, args.minChunk,
+                                       workers)
+            for lig, score in known.items():
+                topK.add(score, lig)
+            if len(getProteins(args)) > 1:
+                print("Protein:", pro)
+            printTopK(topK)
+            if args.prune:
+                print("Ligands pruned: {}".format(prunedCount))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    print("Total Running time: {0:12.3f} sec".format(time.perf_counter() - start))
+
+if __name__ == "__main__":
+    main()
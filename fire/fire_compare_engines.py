@@ -0,0 +1,101 @@
+#
+# Check that the ways of computing the fire simulation (the engines) agree.
+#
+# The engines draw their random numbers differently, so they do not give
+# the same result for one forest.  Instead, many trials are run with each
+# engine at several probability thresholds, and the averages of the percent
+# burned and of the number of iterations are compared with those of the
+# loop engine using Welch's t statistic.  If an engine follows the same
+# rules, |t| is rarely above 3.5; the program exits with status 1 if it is.
+#
+#   python fire_compare_engines.py 20 200
+#
+import argparse      # for command-line arguments
+import sys
+import time
+
+from fire_functions import *
+from sim_functions import *
+
+REFERENCE_ENGINE = "loop"
+
+def parseArguments():
+    """Handle command line arguments
+
+    Run with -h to get details of each argument.
+
+    Returns:
+        the parsed arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("numTreesPerRow", type=int, help="number of trees in row of square grid")
+    parser.add_argument("numberOfTrials", type=int, help="number of fire simulations run with each engine at each probability")
+    parser.add_argument("--probabilities", type=float, nargs="+", default=[0.2, 0.4, 0.5, 0.6, 0.8], help="probability thresholds to compare at")
+    parser.add_argument("--engines", choices=ENGINES + ["batch"], nargs="+", default=[e for e in ENGINES if e != REFERENCE_ENGINE] + ["batch"], help="engines to compare with the loop engine; batch runs all the trials at once with burn_batch_until_out")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the random numbers, to repeat a comparison")
+    parser.add_argument("--limit", type=float, default=3.5, help="largest |t| accepted")
+    return parser.parse_args()
+
+def time_engine_trials(row_size, prob_spread, num_trials, engine):
+    """ Run and time several fire simulations with one engine
+
+    Returns:
+        two numpy arrays, of the percent burned and of the number of
+        iterations of each trial, and the time taken in seconds
+    """
+    percents = np.zeros(num_trials)
+    iters = np.zeros(num_trials)
+    start = time.perf_counter()
+    if engine == "batch":
+        iters, percents = burn_batch_until_out(row_size,
+                                               np.full(num_trials, prob_spread))
+        return percents, iters.astype(float), time.perf_counter() - start
+    for i in range(num_trials):
+        if engine == "bitboard":
+            planes = initialize_bitboard(row_size)
+            iters[i], percents[i] = burn_bitboard_until_out(row_size, planes, prob_spread)
+            continue
+        forest = initialize_forest(row_size)
+        iters[i], percents[i] = burn_until_out(row_size, forest, prob_spread, engine)
+    return percents, iters, time.perf_counter() - start
+
+def welch_t(a, b):
+    """ Welch's t statistic for the difference of the means of two samples
+
+    Returns:
+        the statistic, or 0.0 if neither sample varies
+    """
+    spread = np.sqrt(a.var(ddof=1)/len(a) + b.var(ddof=1)/len(b))
+    if spread == 0.0:
+        return 0.0 if a.mean() == b.mean() else float("inf")
+    return float((a.mean() - b.mean()) / spread)
+
+############################# main() ##########################
+def main():
+    args = parseArguments()
+    np.random.seed(args.seed)
+
+    print("{:>6} {:>8} {:>10} {:>10} {:>8} {:>10} {:>10} {:>8} {:>9}".format(
+          "prob", "engine", "burned", "loop", "t", "iters", "loop", "t", "speedup"))
+    worst = 0.0
+    for prob_spread in args.probabilities:
+        ref_percents, ref_iters, ref_time = time_engine_trials(args.numTreesPerRow,
+            prob_spread, args.numberOfTrials, REFERENCE_ENGINE)
+        for engine in args.engines:
+            percents, iters, engine_time = time_engine_trials(args.numTreesPerRow,
+                prob_spread, args.numberOfTrials, engine)
+            t_percent = welch_t(percents, ref_percents)
+            t_iters = welch_t(iters, ref_iters)
+            worst = max(worst, abs(t_percent), abs(t_iters))
+            print("{:6.2f} {:>8} {:10.4f} {:10.4f} {:8.2f} {:10.2f} {:10.2f} {:8.2f} {:9.1f}".format(
+                  prob_spread, engine, percents.mean(), ref_percents.mean(),
+                  t_percent, iters.mean(), ref_iters.mean(), t_iters,
+                  ref_time / engine_time))
+
+    if worst > args.limit:
+        print("Largest |t| is {:.2f}: the engines do not agree".format(worst))
+        sys.exit(1)
+    print("Largest |t| is {:.2f}: the engines agree".format(worst))
+
+########## Run the main function
+main()
@@ -5,22 +5,48 @@ BURNT = 0
 SMOLDERING = 2
 BURNING = 3
 
+# a tree has only four states, so one byte is enough for it
+FOREST_TYPE = 'u1'
 
 
-def initialize_forest(size):
+def initialize_forest(size, forest=None):
     """ Create the forest of unburnt trees as a 2D array
 
     Parameters:
         size (int): number of trees in each row and column
+        forest (array): if given, this size x size forest is set back to
+            unburnt trees and returned, instead of making a new one
     Returns:
         size x size numpy array
     """
 
-    forest = np.empty( (size, size), dtype='u4')
+    if forest is None:
+        forest = np.empty( (size, size), dtype=FOREST_TYPE)
     forest.fill(UNBURNT)
     return forest
 
 
+def initialize_forests(num_forests, size, forests=None):
+    """ Create several forests of unburnt trees as one 3D array
+
+    Parameters:
+        num_forests (int): number of forests
+        size (int): number of trees in each row and column
+        forests (array): if given, an array of at least num_forests forests
+            whose first num_forests are set back to unburnt trees and
+            returned, instead of making a new array
+
+    Returns:
+        num_forests x size x size numpy array; forests[k] is forest k
+    """
+
+    if forests is None:
+        forests = np.empty( (num_forests, size, size), dtype=FOREST_TYPE)
+    forests = forests[:num_forests]
+    forests.fill(UNBURNT)
+    return forests
+
+
 def light_tree(row_size, forest, x, y):
     """ Tree at position x, y in forest set to smoldering
 
@@ -110,6 +136,412 @@ def forest_burns(forest, row_size, prob_spread):
                     forest[(i, j+1)] = SMOLDERING
 
 
+def count_burning_neighbors(burning):
+    """ Count the burning trees to the north, south, east and west of each tree
+
+    Parameters:
+        burning (array): 2D array of bool, True where a tree is burning, or
+            a 3D array of several such forests
+
+    Returns:
+        uint8 array of the same shape, from 0 to 4 in each tree
+    """
+
+    count = np.zeros(burning.shape, dtype=np.uint8)
+    count[..., 1:, :] += burning[..., :-1, :]   # burning tree to the north
+    count[..., :-1, :] += burning[..., 1:, :]   # burning tree to the south
+    count[..., :, 1:] += burning[..., :, :-1]   # burning tree to the west
+    count[..., :, :-1] += burning[..., :, 1:]   # burning tree to the east
+    return count
+
+def forest_burns_numpy(forest, row_size, prob_spread):
+    """One round of burning the forest, computed on the whole array at once
+
+    Does the same as forest_burns, with numpy operations on the whole forest
+    instead of a python loop over each tree.  In forest_burns an unburnt tree
+    next to k burning trees gets k chances to catch fire, so here it catches
+    fire with probability 1 - (1 - prob_spread)**k.  One random number is
+    drawn for each unburnt tree next to the fire, all in one call.
+
+    Parameters:
+        forest (array): array representing the 2D forest
+        row_size (int): number of trees in each row and column
+        prob_spread (float):
+            probability threshold for determining whether burning tree will
+            spread to neighboring tree
+
+    """
+
+    # burning trees burn down, smoldering trees ignite
+    forest[forest == BURNING] = BURNT
+    burning = forest == SMOLDERING
+    forest[burning] = BURNING
+
+    # probability of catching fire next to 0, 1, 2, 3 or 4 burning trees
+    catch_prob = 1.0 - (1.0 - prob_spread)**np.arange(5)
+    count = count_burning_neighbors(burning)
+    rows, cols = np.nonzero((forest == UNBURNT) & (count > 0))
+    catches = np.random.random_sample(len(rows)) < catch_prob[count[rows, cols]]
+    forest[rows[catches], cols[catches]] = SMOLDERING
+
+
+def burn_out_frontier(forest, prob_spread):
+    """Burn the forest until the fire is out, keeping track of the fire front
+
+    Follows the same rules as forest_burns, but instead of looking at every
+    tree in each round, keeps arrays of the positions of the smoldering and
+    burning trees and looks only at their neighbors.  The number of burnt
+    trees is counted as they burn down.  So the time taken grows with the
+    number of trees that burn, not with the size of the forest times the
+    number of rounds, which makes it much faster on a large forest when the
+    fire does not spread far.
+
+    Parameters:
+        forest (array): array representing the 2D forest; it must be
+            contiguous in memory, as those made by initialize_forest are
+        prob_spread (float):
+            probability threshold for determining whether burning tree will
+            spread to neighboring tree
+
+    Returns:
+        the number of rounds until the fire burned out, and the number of
+        burnt trees
+    """
+
+    num_rows, num_cols = forest.shape
+    trees = forest.reshape(-1)      # the same trees, numbered row by row
+    burning = np.flatnonzero(trees == BURNING)
+    smoldering = np.flatnonzero(trees == SMOLDERING)
+    burnt = np.count_nonzero(trees == BURNT)
+
+    iter = 0
+    while len(burning) > 0 or len(smoldering) > 0:
+        # burning trees burn down, smoldering trees ignite
+        trees[burning] = BURNT
+        burnt += len(burning)
+        trees[smoldering] = BURNING
+        burning = smoldering
+
+        # each unburnt neighbor gets one chance for each burning tree next to it
+        row, col = np.divmod(burning, num_cols)
+        neighbors = np.concatenate((burning[row > 0] - num_cols,
+                                    burning[row < num_rows-1] + num_cols,
+                                    burning[col > 0] - 1,
+                                    burning[col < num_cols-1] + 1))
+        neighbors = neighbors[trees[neighbors] == UNBURNT]
+        catches = np.random.random_sample(len(neighbors)) < prob_spread
+        smoldering = np.unique(neighbors[catches])
+        trees[smoldering] = SMOLDERING
+        iter += 1
+
+    return iter, burnt
+
+
+def burn_out_batch(forests, prob_spreads):
+    """Burn several forests at once until all their fires are out
+
+    Each round is computed as in forest_burns_numpy, but on all the forests
+    together as one 3D array, so the cost of each numpy call is shared by
+    all of them.  When some fires go out, those forests are dropped from
+    the array, so the rounds get cheaper as fewer fires are left.
+
+    Parameters:
+        forests (array): 3D array of forests, as made by initialize_forests,
+            with their first trees lit; it is used as working space, so
+            afterwards it does not hold the burnt forests
+        prob_spreads (array): probability of the fire spreading in each forest
+
+    Returns:
+        two numpy arrays, with the number of rounds until each fire burned
+        out and the number of burnt trees in each forest
+    """
+
+    num_forests = len(forests)
+    iters = np.zeros(num_forests, dtype=np.int64)
+    burnt = np.zeros(num_forests, dtype=np.int64)
+    # probability of catching fire next to 0 to 4 burning trees, per forest
+    catch_prob = 1.0 - (1.0 - np.asarray(prob_spreads, dtype=float)[:, None]) \
+                       **np.arange(5)
+    which = np.arange(num_forests)      # forest number of each forest left
+
+    while True:
+        on_fire = (forests == SMOLDERING) | (forests == BURNING)
+        still_burning = on_fire.any(axis=(1, 2))
+        if not still_burning.all():
+            # record the forests whose fire is out and stop working on them
+            out = ~still_burning
+            burnt[which[out]] = np.count_nonzero(forests[out] == BURNT, axis=(1, 2))
+            forests = forests[still_burning]
+            catch_prob = catch_prob[still_burning]
+            which = which[still_burning]
+            if len(which) == 0:
+                return iters, burnt
+
+        # burning trees burn down, smoldering trees ignite
+        forests[forests == BURNING] = BURNT
+        burning = forests == SMOLDERING
+        forests[burning] = BURNING
+
+        count = count_burning_neighbors(burning)
+        ks, rows, cols = np.nonzero((forests == UNBURNT) & (count > 0))
+        catches = np.random.random_sample(len(ks)) < \
+                  catch_prob[ks, count[ks, rows, cols]]
+        forests[ks[catches], rows[catches], cols[catches]] = SMOLDERING
+        iters[which] += 1
+
+
+#
+# The bitboard form of a forest keeps each state in its own array of bits,
+# called a plane: bit j % 64 of word j // 64 of row i is 1 if tree i, j is
+# in that state.  There are planes for unburnt, smoldering and burning trees;
+# trees in none of them are burnt.  Three bits per tree take 3/8 of the
+# memory of one byte per tree, and each operation on a word works on 64
+# trees at once.
+#
+
+# words of a bitboard worked on together, in whole rows, so the temporary
+# arrays stay small however big the forest is
+BITBOARD_BLOCK = 8192
+
+def initialize_bitboard(size, planes=None):
+    """ Create the bitboard form of a forest of unburnt trees
+
+    The forest is made directly as bits, without the array of one byte per
+    tree that initialize_forest makes.
+
+    Parameters:
+        size (int): number of trees in each row and column
+        planes (tuple): if given, these planes of a size x size forest are
+            set back to unburnt trees and returned, instead of making new ones
+
+    Returns:
+        three 2D uint64 arrays, the unburnt, smoldering and burning planes,
+        with one row of words for each row of trees
+    """
+
+    num_words = (size + 63) // 64
+    if planes is None:
+        planes = tuple(np.empty( (size, num_words), dtype='<u8')
+                       for state in (UNBURNT, SMOLDERING, BURNING))
+    unburnt, smoldering, burning = planes
+    unburnt.fill(np.uint64(2**64 - 1))
+    if size % 64:
+        # the bits past the last tree of a row are left out of every plane
+        unburnt[:, -1] = np.uint64(2**(size % 64) - 1)
+    smoldering.fill(0)
+    burning.fill(0)
+    return planes
+
+def light_tree_bitboard(row_size, planes, x, y):
+    """ Tree at position x, y of a forest in bitboard form set to smoldering
+
+    Parameters:
+        row_size (int): number of trees in each row and column
+        planes (tuple): the unburnt, smoldering and burning planes
+        x (int), y (int): x,y location of tree to set smoldering
+
+    post[planes]:
+        As light_tree, if x, y is properly within the forest, the tree at
+        x, y is set.  Otherwise, one tree in the center of the forest is set.
+    """
+
+    if x >= row_size or y >= row_size :
+        print("Warning: starting position out of bounds; using center")
+        i = int(row_size/2)
+        j = int(row_size/2)
+    else:
+        i = int(x)
+        j = int(y)
+
+    bit = np.uint64(1) << np.uint64(j % 64)
+    for plane in planes:
+        plane[i, j // 64] &= ~bit
+    planes[1][i, j // 64] |= bit
+
+def block_rows(num_words):
+    """ Number of rows of a bitboard worked on together
+
+    Parameters:
+        num_words (int): number of words in each row of the bitboard
+
+    Returns:
+        as many rows as fit in BITBOARD_BLOCK words, and at least one
+    """
+
+    return max(BITBOARD_BLOCK // num_words, 1)
+
+def pack_forest(forest):
+    """ Make the bitboard form of a forest
+
+    Parameters:
+        forest (array): array representing the 2D forest
+
+    Returns:
+        three 2D uint64 arrays, the unburnt, smoldering and burning planes,
+        with one row of words for each row of trees
+    """
+
+    num_rows, num_cols = forest.shape
+    num_words = (num_cols + 63) // 64
+    padding = ((0, 0), (0, num_words*64 - num_cols))
+    planes = tuple(np.empty( (num_rows, num_words), dtype='<u8')
+                   for state in (UNBURNT, SMOLDERING, BURNING))
+    block = block_rows(num_words)
+    for start in range(0, num_rows, block):
+        rows = forest[start:start + block]
+        for state, plane in zip((UNBURNT, SMOLDERING, BURNING), planes):
+            bits = np.packbits(np.pad(rows == state, padding), axis=1,
+                               bitorder='little')
+            plane[start:start + block] = bits.view('<u8')
+    return planes
+
+def unpack_forest(planes, forest):
+    """ Set a forest from its bitboard form
+
+    Parameters:
+        planes (tuple): the unburnt, smoldering and burning planes
+        forest (array): array representing the 2D forest, which is set
+    """
+
+    num_rows, num_cols = forest.shape
+    forest.fill(BURNT)
+    block = block_rows(planes[0].shape[1])
+    for start in range(0, num_rows, block):
+        rows = forest[start:start + block]
+        for state, plane in zip((UNBURNT, SMOLDERING, BURNING), planes):
+            bits = np.unpackbits(plane[start:start + block].view(np.uint8),
+                                 axis=1, count=num_cols, bitorder='little')
+            rows[bits.view(bool)] = state
+
+def count_bits(words):
+    """ Number of bits that are 1 in an array of uint64 words """
+
+    if hasattr(np, "bitwise_count"):      # numpy 2.0 and later
+        return int(np.bitwise_count(words).sum())
+    return int(np.unpackbits(words.view(np.uint8)).sum())
+
+def spread_bits(sides, prob_spread):
+    """ Keep each bit that is 1 with probability prob_spread, then combine
+
+    Parameters:
+        sides (array): 2D uint64 array with one row of words for each side
+            of a tree, whose bits are the trees that may catch fire from
+            that side
+        prob_spread (float): probability of keeping each bit
+
+    Returns:
+        1D uint64 array of the bits kept from any side
+    """
+
+    bits = np.unpackbits(sides.view(np.uint8), bitorder='little')
+    ones = np.flatnonzero(bits)
+    bits[ones] = np.random.random_sample(len(ones)) < prob_spread
+    kept = np.packbits(bits, bitorder='little').view('<u8').reshape(sides.shape)
+    return np.bitwise_or.reduce(kept, axis=0)
+
+def rows_on_fire(planes, first, last):
+    """ The rows of a forest in bitboard form with trees on fire
+
+    Parameters:
+        planes (tuple): the unburnt, smoldering and burning planes
+        first (int), last (int): only rows first up to last are looked at
+
+    Returns:
+        the first row with a smoldering or burning tree, and one past the
+        last one; two equal numbers if there is none
+    """
+
+    unburnt, smoldering, burning = planes
+    block = block_rows(unburnt.shape[1])
+    on_fire_first, on_fire_last = last, first
+    for start in range(first, last, block):
+        stop = min(start + block, last)
+        on_fire = np.flatnonzero((smoldering[start:stop] | burning[start:stop]).any(axis=1))
+        if len(on_fire):
+            on_fire_first = min(on_fire_first, start + on_fire[0])
+            on_fire_last = start + on_fire[-1] + 1
+    return (on_fire_first, on_fire_last) if on_fire_first < on_fire_last else (0, 0)
+
+def burn_out_bitboard(planes, num_cols, prob_spread):
+    """Burn a forest in bitboard form until the fire is out
+
+    Each round, the burning plane is shifted one row up and down and one
+    bit left and right (carrying bits between words), to find the trees
+    next to a burning tree on each side.  For each side, the unburnt trees
+    found catch fire with probability prob_spread, so as in forest_burns a
+    tree gets one chance for each burning tree next to it.  Only the band
+    of rows with trees on fire, and one row on each side of it, is worked
+    on, a block of rows at a time, so the memory needed beyond the planes
+    does not grow with the forest.
+
+    Parameters:
+        planes (tuple): the unburnt, smoldering and burning planes of the
+            forest, from initialize_bitboard or pack_forest; they are changed
+        num_cols (int): number of trees in each row of the forest
+        prob_spread (float):
+            probability threshold for determining whether burning tree will
+            spread to neighboring tree
+
+    Returns:
+        the number of rounds until the fire burned out, and the number of
+        burnt trees
+    """
+
+    unburnt, smoldering, burning = planes
+    num_rows, num_words = unburnt.shape
+    high_bit = np.uint64(63)
+    one = np.uint64(1)
+    # the trees in no plane are burnt
+    burnt = num_rows*num_cols - sum(count_bits(plane) for plane in planes)
+    block = block_rows(num_words)
+    work = np.zeros(4*min(block, num_rows)*num_words, dtype=burning.dtype)
+
+    # only the rows from first up to last have trees on fire
+    first, last = rows_on_fire(planes, 0, num_rows)
+
+    iter = 0
+    while first < last:
+        # the fire can spread at most one row up or down in a round
+        first, last = max(first - 1, 0), min(last + 1, num_rows)
+
+        # burning trees burn down, smoldering trees ignite
+        for start in range(first, last, block):
+            stop = min(start + block, last)
+            burnt += count_bits(burning[start:stop])
+            burning[start:stop] = smoldering[start:stop]
+            smoldering[start:stop] = 0
+
+        for start in range(first, last, block):
+            stop = min(start + block, last)
+            u = unburnt[start:stop]
+            b = burning[start:stop]
+
+            # the unburnt trees next to a burning tree on each side; the
+            # rows just outside the block are read from the whole plane
+            sides = work[:4*u.size].reshape((4,) + u.shape)
+            sides[0, 0] = burning[start - 1] if start > 0 else 0  # to the north
+            sides[0, 1:] = b[:-1]
+            sides[1, -1] = burning[stop] if stop < num_rows else 0  # to the south
+            sides[1, :-1] = b[1:]
+            np.left_shift(b, one, out=sides[2])         # to the west
+            sides[2, :, 1:] |= b[:, :-1] >> high_bit
+            np.right_shift(b, one, out=sides[3])        # to the east
+            sides[3, :, :-1] |= b[:, 1:] << high_bit
+            sides &= u
+
+            # only the words with a tree that may catch fire are looked at
+            sides = sides.reshape(4, -1)
+            near = np.flatnonzero(sides[0] | sides[1] | sides[2] | sides[3])
+            catches = spread_bits(sides.take(near, axis=1), prob_spread)
+            smoldering[start:stop].reshape(-1)[near] = catches
+            u.reshape(-1)[near] ^= catches
+        iter += 1
+
+        first, last = rows_on_fire(planes, first, last)
+
+    return iter, burnt
+
+
 def forest_is_burning(forest):
     """ Checks for any remaining smoldering or burning trees
 
@@ -121,11 +553,7 @@ def forest_is_burning(forest):
         False if all trees are burnt.
 
     """
-    for row in forest:
-        for tree in row:
-            if tree == SMOLDERING or tree == BURNING:
-                return True
-    return False
+    return bool(np.any((forest == SMOLDERING) | (forest == BURNING)))
 
 def get_percent_burned(forest, row_size):
     """ Determine how many trees burned during fire
@@ -140,13 +568,7 @@ def get_percent_burned(forest, row_size):
             as a float between 0 and 1.
     """
 
-    sum = 0
-    for row in forest:
-        for tree in row:
-            if tree == BURNT:
-                sum +=1
-
-    return float(sum)/float(row_size*row_size)
+    return float(np.count_nonzero(forest == BURNT))/float(row_size*row_size)
 
 def print_forest(forest):
     """ Ascii display of forest
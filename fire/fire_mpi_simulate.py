@@ -11,12 +11,18 @@
 
 import matplotlib.pyplot as plt
 import math
+import os
+import sys
 import time
 from mpi4py import MPI
 
 from fire_functions import *
 from sim_functions import *
 
+# the phase timer is shared with the drug design programs, one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from phase_timer import PhaseTimer
+
 
 ############################# main() ##########################
 def main():
@@ -33,8 +39,9 @@ def main():
     # each process gets sent row_size, prob_spread_increment, and
     # its number of trials to perform (via a broadcast)
     if id == 0:
-        # row_size, prob_spread_increment, tot_num_trials
-        args = parseArguments()
+        # row_size, prob_spread_increment, tot_num_trials, engine, batch,
+        # timing, trace
+        args = parseArguments(timing_options=True)
     else:
         args = None
 
@@ -44,6 +51,12 @@ def main():
     row_size = sim_data[0]
     prob_spread_increment =sim_data[1]
     tot_num_trials = sim_data[2]
+    engine = sim_data[3]
+    batch = sim_data[4]
+    trace_path = sim_data[6]
+    # records where each process spends its time, if asked for
+    timer = PhaseTimer(comm, sim_data[5] or trace_path is not None,
+                       trace_path is not None)
 
     # determine number of trials that each process will do
     # by checking whether trials are divisible by number of processes
@@ -71,20 +84,12 @@ def main():
     # The primary work: run the trials using each set of proabilities.
     # There will be num_trials x tot_prob_trials individual fire simulations
     # run, each with a new forest.
-    for i in range(num_trials):
-        idx = 0     # index into result data array
-        for prob_spread in np.arange(0.1, 1.0, prob_spread_increment):
-            forest = initialize_forest(row_size)
-            iter, percent_burned = burn_until_out(row_size, forest, prob_spread)
-
-            if i == 0: #put proability for x axis in result once
-                percent_burned_data[(idx,0)] = prob_spread
-                iters_per_sim_data[(idx,0)] = prob_spread
-            #add data for this trial to running total for each trial
-            percent_burned_data[(idx,1)] += percent_burned
-            iters_per_sim_data[(idx,1)] += iter
-
-            idx += 1
+    probabilities = np.arange(0.1, 1.0, prob_spread_increment)
+    percent_burned_data[:,0] = probabilities
+    iters_per_sim_data[:,0] = probabilities
+    with timer.phase("compute"):
+        percent_burned_data[:,1], iters_per_sim_data[:,1] = \
+            run_trials(row_size, probabilities, num_trials, engine, batch)
 
     # find average percent burned and number of iterations
     # for each probability threashold
@@ -95,15 +100,17 @@ def main():
     # each worker will send its computed data to the master, who receives
     # it in turn from each worker and updates its copy
     if id !=0:
-        comm.Send(percent_burned_data, dest=0, tag=1)
-        comm.Send(iters_per_sim_data, dest=0, tag=2)
+        with timer.phase("send"):
+            comm.Send(percent_burned_data, dest=0, tag=1)
+            comm.Send(iters_per_sim_data, dest=0, tag=2)
         proc_time = MPI.Wtime() - start
         print("Process {0} Running time: {1:12.4f} seconds".format(id, proc_time))
     else:  #master
         # get each worker's arrays and add the contents to its arrays
         for proc in range(1, numProcesses):
-            comm.Recv(recv_percent_burned_data, source=proc, tag=1)
-            comm.Recv(recv_iters_per_sim_data, source=proc, tag=2)
+            with timer.phase("recv_wait"):
+                comm.Recv(recv_percent_burned_data, source=proc, tag=1)
+                comm.Recv(recv_iters_per_sim_data, source=proc, tag=2)
 
             for row in range(tot_prob_trials):
                 percent_burned_data[(row,1)] += recv_percent_burned_data[(row,1)]
@@ -119,6 +126,10 @@ def main():
         total_time = finish - start
         print("Total Running time: {0:12.4f} seconds".format(total_time))
 
+    # before the master shows the plots, which waits for the window to close
+    timer.report(trace_path)
+
+    if id == 0:
         # Create a figure with 2 plots of the simulation results
         upper_title = "Simulation: {0} trials for each probability\n {1}x{1} forest\nRun time on {2} processes: {3:12.4f} seconds"
         upper_title = upper_title.format(tot_num_trials, row_size,  numProcesses, total_time)
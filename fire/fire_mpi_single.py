@@ -0,0 +1,234 @@
+#
+# Run one simulation of a fire burning at one probability threshold,
+# with the forest split among several MPI processes.
+#
+# fire_mpi_simulate.py runs many small forests, one per process at a time.
+# This version runs one forest that may be too large for one process: each
+# process holds a strip of consecutive rows of it.  To find which of its
+# trees are next to a burning tree, a process also needs the row just above
+# and the row just below its strip, which belong to its neighbors.  So it
+# keeps a copy of them, called ghost rows, that is updated every round with
+# MPI Sendrecv.  After each round an Allreduce adds up the trees still on
+# fire in every strip, so every process knows whether the fire is out.
+#
+# The random number used for tree i, j in round r is made from the seed,
+# r, i and j alone (see tree_random), so the fire burns the same way no
+# matter how many processes it is split among.
+#
+#   mpirun -np 4 python fire_mpi_single.py 2000 0.6 --seed 1
+#
+# Ported to python from the original Shodor foundation example:
+#  https://www.shodor.org/refdesk/Resources/Tutorials/BasicMPI/
+#
+import argparse      # for command-line arguments
+import os
+import sys
+from mpi4py import MPI
+
+from fire_functions import *
+
+# the phase timer is shared with the drug design programs, one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from phase_timer import PhaseTimer
+
+# rows of a strip looked at together
+ROW_BLOCK = 256
+
+def parseArguments():
+    """Handle command line arguments
+
+    Run with -h to get details of each argument.
+
+    Returns:
+        the parsed arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("numTreesPerRow", type=int, help="number of trees in row of square grid")
+    parser.add_argument("probabilityOfSpread", type=float, help="probability threshold of fire spreading from one burning tree to a non-burning tree next to it (percent between 0 and 1)")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the random numbers; the same seed gives the same fire with any number of processes")
+    parser.add_argument("--save", metavar="file", default=None, help="collect the burnt forest on process 0 and save it to this numpy .npy file")
+    parser.add_argument("--timing", action="store_true", help="report the time each process spent computing, sending and waiting")
+    parser.add_argument("--trace", metavar="file", default=None, help="write a timeline of each process to this file in Chrome trace format; implies --timing")
+    return parser.parse_args()
+
+def strip_rows(row_size, num_strips, strip):
+    """ Rows of the forest in one strip
+
+    The rows are split into consecutive strips whose sizes differ by at
+    most one.
+
+    Returns:
+        the first row of the strip, and one past its last row
+    """
+    n, remainder = divmod(row_size, num_strips)
+    first = strip * n + min(strip, remainder)
+    return first, first + n + (1 if strip < remainder else 0)
+
+# constants of the SplitMix64 generator
+GOLDEN_GAMMA = 0x9e3779b97f4a7c15
+MIX_1 = 0xbf58476d1ce4e5b9
+MIX_2 = 0x94d049bb133111eb
+WORD = 2**64 - 1
+
+def mix(z):
+    """ The SplitMix64 mixing function, on a python int or a uint64 array """
+    if isinstance(z, np.ndarray):
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(MIX_1)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(MIX_2)
+        return z ^ (z >> np.uint64(31))
+    z = ((z ^ (z >> 30)) * MIX_1) & WORD
+    z = ((z ^ (z >> 27)) * MIX_2) & WORD
+    return z ^ (z >> 31)
+
+def tree_random(seed, iter, trees):
+    """ The random numbers for some trees of the forest in one round
+
+    Each number is made from the seed, the round and the number of the
+    tree alone, as SplitMix64 does: the round's key plus the tree number
+    times a constant is scrambled by mix.  So a tree gets the same number
+    whichever process has it, and numbers are only made for the trees that
+    need them.
+
+    Parameters:
+        seed (int): seed of the whole simulation
+        iter (int): number of the round
+        trees (array): numbers of the trees, row * num_cols + column
+
+    Returns:
+        array of random numbers between 0 and 1, one for each tree
+    """
+    key = mix((mix(seed & WORD) + (iter + 1)*GOLDEN_GAMMA) & WORD)
+    z = mix(trees.astype(np.uint64)*np.uint64(GOLDEN_GAMMA) + np.uint64(key))
+    return (z >> np.uint64(11)) * 2.0**-53
+
+def exchange_ghost_rows(comm, strip):
+    """ Update the ghost rows of a strip from the strips above and below
+
+    Parameters:
+        comm (Comm): the communicator of all the processes, in strip order
+        strip (array): the rows of this process, with a ghost row before
+            and after them; the first and last strips have no neighbor on
+            one side, and keep that ghost row as burnt trees
+    """
+    id = comm.Get_rank()
+    above = id - 1 if id > 0 else MPI.PROC_NULL
+    below = id + 1 if id < comm.Get_size() - 1 else MPI.PROC_NULL
+    # send the first row up while receiving the row below the strip
+    comm.Sendrecv(strip[1], dest=above, recvbuf=strip[-1], source=below)
+    # send the last row down while receiving the row above the strip
+    comm.Sendrecv(strip[-2], dest=below, recvbuf=strip[0], source=above)
+
+def strip_catches_fire(strip, first_row, prob_spread, seed, iter):
+    """ Set fire to the unburnt trees of a strip next to burning trees
+
+    As in forest_burns_numpy, a tree next to k burning trees catches fire
+    with probability 1 - (1 - prob_spread)**k.  Only the blocks of rows
+    next to a burning tree are looked at.
+
+    Parameters:
+        strip (array): the rows of this process, with up to date ghost rows
+        first_row (int): row of the whole forest that is row 1 of the strip
+        prob_spread (float):
+            probability threshold for determining whether burning tree will
+            spread to neighboring tree
+        seed (int), iter (int): seed and round number of the random numbers
+    """
+    num_cols = strip.shape[1]
+    catch_prob = 1.0 - (1.0 - prob_spread)**np.arange(5)
+    on_fire = np.flatnonzero((strip == BURNING).any(axis=1))
+    if len(on_fire) == 0:
+        return
+    # rows of the strip (not ghost rows) that may be next to a burning tree
+    start = max(on_fire[0] - 1, 1)
+    stop = min(on_fire[-1] + 2, len(strip) - 1)
+    for block in range(start, stop, ROW_BLOCK):
+        end = min(block + ROW_BLOCK, stop)
+        count = count_burning_neighbors(strip[block-1:end+1] == BURNING)[1:-1]
+        trees = strip[block:end]
+        rows, cols = np.nonzero((trees == UNBURNT) & (count > 0))
+        numbers = (first_row + block - 1 + rows) * num_cols + cols
+        catches = tree_random(seed, iter, numbers) < catch_prob[count[rows, cols]]
+        trees[rows[catches], cols[catches]] = SMOLDERING
+
+############################# main() ##########################
+def main():
+    # MPI information
+    comm = MPI.COMM_WORLD
+    id = comm.Get_rank()            #number of the process running the code
+    numProcesses = comm.Get_size()  #total number of processes running
+
+    start = MPI.Wtime() # start the timing
+    # the master gets the arguments and sends them to everyone, with the
+    # seed it chose if none was given
+    if id == 0:
+        args = parseArguments()
+        if args.seed is None:
+            args.seed = int(np.random.SeedSequence().entropy % 2**63)
+    else:
+        args = None
+    args = comm.bcast(args, root=0)
+    row_size = args.numTreesPerRow
+    prob_spread = args.probabilityOfSpread
+    if row_size < numProcesses:
+        if id == 0:
+            print("Need at least one row of trees per process, aborting")
+        return
+    timer = PhaseTimer(comm, args.timing or args.trace is not None,
+                       args.trace is not None)
+
+    # this process's rows, with a ghost row before and after them
+    first_row, last_row = strip_rows(row_size, numProcesses, id)
+    strip = np.empty( (last_row - first_row + 2, row_size), dtype=FOREST_TYPE)
+    strip.fill(UNBURNT)
+    strip[0] = BURNT
+    strip[-1] = BURNT
+    trees = strip[1:-1]     # the rows of this process, without ghost rows
+
+    # start burning at middle tree, in the strip that has it
+    middle_tree_index = int(row_size/2)
+    if first_row <= middle_tree_index < last_row:
+        trees[middle_tree_index - first_row, middle_tree_index] = SMOLDERING
+
+    # number of trees on fire in the whole forest
+    on_fire = np.zeros(1, dtype=np.int64)
+    on_fire[0] = np.count_nonzero((trees == SMOLDERING) | (trees == BURNING))
+    with timer.phase("recv_wait"):
+        comm.Allreduce(MPI.IN_PLACE, on_fire, op=MPI.SUM)
+
+    iter = 0 # how many iterations before the fire burns out
+    while on_fire[0] > 0:
+        # burning trees burn down, smoldering trees ignite
+        with timer.phase("compute"):
+            trees[trees == BURNING] = BURNT
+            trees[trees == SMOLDERING] = BURNING
+        with timer.phase("send"):
+            exchange_ghost_rows(comm, strip)
+        with timer.phase("compute"):
+            strip_catches_fire(strip, first_row, prob_spread, args.seed, iter)
+            on_fire[0] = np.count_nonzero((trees == SMOLDERING) | (trees == BURNING))
+        with timer.phase("recv_wait"):
+            comm.Allreduce(MPI.IN_PLACE, on_fire, op=MPI.SUM)
+        iter += 1
+
+    burnt = np.array([np.count_nonzero(trees == BURNT)], dtype=np.int64)
+    total_burnt = np.zeros(1, dtype=np.int64)
+    with timer.phase("recv_wait"):
+        comm.Reduce(burnt, total_burnt, op=MPI.SUM, root=0)
+    if args.save is not None:
+        with timer.phase("send"):
+            strips = comm.gather(trees, root=0)
+        if id == 0:
+            np.save(args.save, np.vstack(strips))
+
+    if id == 0:
+        percent_burned = float(total_burnt[0])/float(row_size*row_size)
+        print("Seed: {}".format(args.seed))
+        print("Iterations until fire burns out: {}".format(iter))
+        print("Percent burned: {0:4.3f}".format(percent_burned))
+        finish = MPI.Wtime()  # end the timing
+        print("Total Running time: {0:12.4f} seconds".format(finish - start))
+
+    timer.report(args.trace)
+
+########## Run the main function
+main()
@@ -10,6 +10,7 @@ import argparse      # for command-line arguments
 import matplotlib.pyplot as plt
 
 from fire_functions import *
+from sim_functions import burn_until_out, burn_bitboard_until_out, ENGINES, DFLT_engine
 
 def parseArguments():
     """Handle command line arguments
@@ -24,33 +25,31 @@ def parseArguments():
     parser = argparse.ArgumentParser()
     parser.add_argument("numTreesPerRow", help="number of trees in row of square grid")
     parser.add_argument("probabilityOfSpread", help="probability threshold of fire spreading from one burning tree to a non-burning tree next to it (percent between 0 and 1)")
+    parser.add_argument("--engine", choices=ENGINES, default=DFLT_engine, help="how each round of burning is computed: loop visits each tree in python, numpy works on the whole forest at once, frontier only on the trees next to the fire, bitboard on 64 trees at a time stored as bits")
     # could add: optional arguments for i, j position of starting tree
     args = parser.parse_args()
 
     row_size = int(args.numTreesPerRow)
     prob_spread = float(args.probabilityOfSpread)
 
-    return row_size, prob_spread
+    return row_size, prob_spread, args.engine
 
 ############################# main() ##########################
 def main():
 
-    row_size, prob_spread = parseArguments()
-
-    forest = initialize_forest(row_size)
-
-    percent_burned = 0.0
-    # for now start burning at midlle tree
-    middle_tree_index = int(row_size/2)
-    light_tree(row_size, forest, middle_tree_index, middle_tree_index)
-
-    iter = 0 # how many iterations before the fire burns out
-    while forest_is_burning(forest):
-        # print("burning") # debug
-        forest_burns(forest, row_size, prob_spread)
-        iter += 1
-
-    percent_burned = get_percent_burned(forest, row_size)
+    row_size, prob_spread, engine = parseArguments()
+
+    # starts burning at the middle tree
+    if engine == "bitboard":
+        # the forest is kept as bits, and made into an array of bytes only
+        # to be plotted
+        planes = initialize_bitboard(row_size)
+        iter, percent_burned = burn_bitboard_until_out(row_size, planes, prob_spread)
+        forest = np.empty( (row_size, row_size), dtype=FOREST_TYPE)
+        unpack_forest(planes, forest)
+    else:
+        forest = initialize_forest(row_size)
+        iter, percent_burned = burn_until_out(row_size, forest, prob_spread, engine)
     print("Iterations until fire burns out: {}".format(iter))
     print("Percent burned: {0:4.3f}".format(percent_burned))
     # print_forest(forest)
@@ -19,7 +19,7 @@ from sim_functions import *
 def main():
     start = time.process_time()  # start the timing
 
-    row_size, prob_spread_increment, num_trials = parseArguments()
+    row_size, prob_spread_increment, num_trials, engine, batch = parseArguments()
 
     # determine how many probabilities between .1 up to but not including 1.0
     # will be tried, based on increment given on command line.
@@ -36,20 +36,11 @@ def main():
     # The primary work: run the trials using each set of proabilities.
     # There will be num_trials x tot_prob_trials individual fire simulations
     # run, each with a new forest.
-    for i in range(num_trials):
-        idx = 0     # index into result data array
-        for prob_spread in np.arange(0.1, 1.0, prob_spread_increment):
-            forest = initialize_forest(row_size)
-            iter, percent_burned = burn_until_out(row_size, forest, prob_spread)
-
-            if i == 0: #put proability for x axis in result once
-                percent_burned_data[(idx,0)] = prob_spread
-                iters_per_sim_data[(idx,0)] = prob_spread
-            #add data for this trial to running total for each trial
-            percent_burned_data[(idx,1)] += percent_burned
-            iters_per_sim_data[(idx,1)] += iter
-
-            idx += 1
+    probabilities = np.arange(0.1, 1.0, prob_spread_increment)
+    percent_burned_data[:,0] = probabilities
+    iters_per_sim_data[:,0] = probabilities
+    percent_burned_data[:,1], iters_per_sim_data[:,1] = \
+        run_trials(row_size, probabilities, num_trials, engine, batch)
 
     # find average percent burned and number of iterations
     # for each probability threashold
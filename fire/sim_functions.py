@@ -7,11 +7,21 @@
 import argparse      # for command-line arguments
 from fire_functions import *
 
-def parseArguments():
+# ways of computing one round of burning, by name; the frontier and
+# bitboard engines burn the whole fire at once
+BURN_STEPS = {"loop": forest_burns, "numpy": forest_burns_numpy}
+ENGINES = list(BURN_STEPS) + ["frontier", "bitboard"]
+DFLT_engine = "numpy"
+
+def parseArguments(timing_options=False):
     """Handle command line arguments
 
     Run with -h to get details of each argument.
 
+    Parameters:
+        timing_options (bool): also accept the --timing and --trace options
+            of the MPI version
+
     Returns:
         A list containg each argument provided
     """
@@ -21,6 +31,11 @@ def parseArguments():
     parser.add_argument("numTreesPerRow", help="number of trees in row of square grid")
     parser.add_argument("probabilityIncrement", help="amount to increment the probability threshold of fire spreading for each set of probability trials")
     parser.add_argument("numberOfTrials", help="number of times to run the fire simulation with a new forest for each proability in set of probabilities")
+    parser.add_argument("--engine", choices=ENGINES, default=DFLT_engine, help="how each round of burning is computed: loop visits each tree in python, numpy works on the whole forest at once, frontier only on the trees next to the fire, bitboard on 64 trees at a time stored as bits")
+    parser.add_argument("--batch", metavar="forests", type=int, default=0, help="simulate this many forests at once as one 3D array, taking the trials for every probability in turn; the rules of the numpy engine are used and --engine is ignored")
+    if timing_options:
+        parser.add_argument("--timing", action="store_true", help="report the time each process spent computing, sending and waiting")
+        parser.add_argument("--trace", metavar="file", default=None, help="write a timeline of each process to this file in Chrome trace format; implies --timing")
 
     args = parser.parse_args()
 
@@ -28,10 +43,14 @@ def parseArguments():
     prob_spread_increment = float(args.probabilityIncrement)
     num_trials = int(args.numberOfTrials)
 
-    return [row_size, prob_spread_increment, num_trials]
+    if timing_options:
+        return [row_size, prob_spread_increment, num_trials, args.engine,
+                args.batch, args.timing, args.trace]
+    return [row_size, prob_spread_increment, num_trials, args.engine,
+            args.batch]
 
 
-def burn_until_out(row_size, forest, prob_spread):
+def burn_until_out(row_size, forest, prob_spread, engine=DFLT_engine):
     """ one simulation of the buring forest
     Parameters:
         row_size (int): number of trees in each row and column
@@ -39,6 +58,8 @@ def burn_until_out(row_size, forest, prob_spread):
         prob_spread (float):
             probability threshold for determining whether burning tree will
             spread to neighboring tree
+        engine (str): name of the way each round of burning is computed,
+            one of ENGINES
     """
 
     percent_burned = 0.0
@@ -46,10 +67,21 @@ def burn_until_out(row_size, forest, prob_spread):
     middle_tree_index = int(row_size/2)
     light_tree(row_size, forest, middle_tree_index, middle_tree_index)
 
+    if engine == "frontier":
+        iter, burnt = burn_out_frontier(forest, prob_spread)
+        return int(iter), float(burnt)/float(row_size*row_size)
+    if engine == "bitboard":
+        # burn_bitboard_until_out does the same without the forest of bytes
+        planes = pack_forest(forest)
+        iter, burnt = burn_out_bitboard(planes, row_size, prob_spread)
+        unpack_forest(planes, forest)
+        return int(iter), float(burnt)/float(row_size*row_size)
+
+    forest_burns_step = BURN_STEPS[engine]
     iter = 0 # how many iterations before the fire burns out
     while forest_is_burning(forest):
         # print("burning") # debug
-        forest_burns(forest, row_size, prob_spread)
+        forest_burns_step(forest, row_size, prob_spread)
         iter += 1
 
     percent_burned = get_percent_burned(forest, row_size)
@@ -57,3 +89,91 @@ def burn_until_out(row_size, forest, prob_spread):
     # print_forest(forest)  #debug
 
     return int(iter), float(percent_burned)
+
+
+def burn_bitboard_until_out(row_size, planes, prob_spread):
+    """ one simulation of the burning forest, kept in bitboard form
+    Parameters:
+        row_size (int): number of trees in each row and column
+        planes (tuple): the unburnt, smoldering and burning planes of a
+            forest of unburnt trees, from initialize_bitboard; they are
+            changed, and can be unpacked with unpack_forest to look at
+        prob_spread (float):
+            probability threshold for determining whether burning tree will
+            spread to neighboring tree
+    """
+
+    # for now start burning at midlle tree
+    middle_tree_index = int(row_size/2)
+    light_tree_bitboard(row_size, planes, middle_tree_index, middle_tree_index)
+
+    iter, burnt = burn_out_bitboard(planes, row_size, prob_spread)
+    return int(iter), float(burnt)/float(row_size*row_size)
+
+
+def burn_batch_until_out(row_size, prob_spreads, forests=None):
+    """ several simulations of the burning forest, run together
+    Parameters:
+        row_size (int): number of trees in each row and column
+        prob_spreads (array): probability threshold of each simulation
+        forests (array): if given, an array of at least len(prob_spreads)
+            forests to use instead of making a new one
+    Returns:
+        two numpy arrays, with the iterations and the percent burned of
+        each simulation
+    """
+
+    forests = initialize_forests(len(prob_spreads), row_size, forests)
+    # for now start burning at midlle tree
+    middle_tree_index = int(row_size/2)
+    forests[:, middle_tree_index, middle_tree_index] = SMOLDERING
+
+    iters, burnt = burn_out_batch(forests, prob_spreads)
+    return iters, burnt/float(row_size*row_size)
+
+
+def run_trials(row_size, probabilities, num_trials, engine=DFLT_engine, batch=0):
+    """ num_trials simulations of the burning forest at each probability
+    Parameters:
+        row_size (int): number of trees in each row and column
+        probabilities (array): probability thresholds to simulate
+        num_trials (int): number of simulations at each probability
+        engine (str): one of ENGINES
+        batch (int): if not 0, simulate this many forests at once with
+            burn_batch_until_out; the trials are taken in order, with all
+            the probabilities of a trial before the next trial
+    Returns:
+        two numpy arrays, with the sums over the trials of the percent
+        burned and of the iterations at each probability
+    """
+
+    percent_sums = np.zeros(len(probabilities))
+    iter_sums = np.zeros(len(probabilities))
+    if batch == 0:
+        forest = None   # the same array is used for every forest
+        for i in range(num_trials):
+            for idx, prob_spread in enumerate(probabilities):
+                if engine == "bitboard":
+                    # the forest is kept as bits, with no array of bytes
+                    forest = initialize_bitboard(row_size, forest)
+                    iter, percent_burned = burn_bitboard_until_out(row_size,
+                                                    forest, prob_spread)
+                else:
+                    forest = initialize_forest(row_size, forest)
+                    iter, percent_burned = burn_until_out(row_size, forest,
+                                                          prob_spread, engine)
+                percent_sums[idx] += percent_burned
+                iter_sums[idx] += iter
+        return percent_sums, iter_sums
+
+    # simulation number s is trial s // len(probabilities) at probability
+    # number s % len(probabilities)
+    num_sims = num_trials*len(probabilities)
+    forests = initialize_forests(min(batch, num_sims), row_size)
+    for first in range(0, num_sims, batch):
+        which = np.arange(first, min(first + batch, num_sims)) % len(probabilities)
+        iters, percents = burn_batch_until_out(row_size, probabilities[which],
+                                               forests)
+        percent_sums += np.bincount(which, percents, len(probabilities))
+        iter_sums += np.bincount(which, iters, len(probabilities))
+    return percent_sums, iter_sums
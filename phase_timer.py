@@ -0,0 +1,180 @@
+#
+# Per-process phase timing for the MPI examples in this repository.
+#
+# Each process records how long it spends in each phase of its work
+# (computing, sending, waiting for a message) with a PhaseTimer.  At the end
+# the timings of all processes are gathered on process 0, which prints a
+# table of them and a summary of how evenly the work was spread.  The
+# intervals can also be written as a timeline in the Chrome trace format,
+# which can be opened at chrome://tracing or https://ui.perfetto.dev
+#
+# Used by both the drug-design and fire programs, which add this directory
+# to their module search path.
+#
+#   timer = PhaseTimer(comm)
+#   with timer.phase("compute"):
+#       ...
+#   timer.report("trace.json")      # called by every process
+#
+
+import json
+import sys
+
+from mpi4py import MPI
+
+PHASES = ("compute", "send", "recv_wait", "idle")
+
+
+class _Phase:
+    """Context manager that adds the time spent in its block to a phase."""
+
+    __slots__ = ("timer", "name", "begin")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.begin = MPI.Wtime()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, self.begin, MPI.Wtime())
+        return False
+
+
+class _NoPhase:
+    """Context manager used when timing is turned off; it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_PHASE = _NoPhase()
+
+
+class PhaseTimer:
+    """Time spent by one MPI process in each phase of its work.
+
+    The phases are:
+        compute:    useful work
+        send:       sending messages, and taking part in reductions or
+                    gathers as a sender
+        recv_wait:  waiting for a message to arrive
+        idle:       waiting at the end for the slowest process
+    Time not in any phase is reported as "other".
+
+    Parameters:
+        comm (Comm): the communicator of all the processes being timed;
+            creating a timer is a collective operation on it
+        enabled (bool): when False, phase() and report() do nothing, so
+            the timer can be left in place at no cost
+        trace (bool): also keep every interval, for the timeline
+    """
+
+    def __init__(self, comm, enabled=True, trace=False):
+        self.comm = comm
+        self.enabled = enabled
+        self.events = [] if trace else None
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        if enabled:
+            comm.Barrier()  # so every process starts its clock together
+        self.start = MPI.Wtime()
+
+    def phase(self, name):
+        """Return a context manager that times its block as phase name."""
+        if not self.enabled:
+            return _NO_PHASE
+        return _Phase(self, name)
+
+    def add(self, name, begin, end):
+        """Add the interval from MPI.Wtime() begin to end to phase name."""
+        self.totals[name] = self.totals.get(name, 0.0) + end - begin
+        if self.events is not None:
+            self.events.append((name, begin - self.start, end - begin))
+
+    def report(self, trace_path=None, root=0, out=sys.stdout):
+        """Gather every process's timings and print them on process root.
+
+        Every process must call this.  Each first waits for the others,
+        which is counted as idle time.
+
+        Parameters:
+            trace_path (str): if given, process root writes the intervals of
+                every process to this file in the Chrome trace format
+            root (int): process that prints the report
+            out (file): where to print it
+        """
+        if not self.enabled:
+            return
+        with self.phase("idle"):
+            self.comm.Barrier()
+        wall = MPI.Wtime() - self.start
+        mine = (MPI.Get_processor_name(), wall, self.totals, self.events)
+        everyone = self.comm.gather(mine, root=root)
+        if self.comm.Get_rank() != root:
+            return
+        print_phase_table(everyone, out)
+        if trace_path is not None and self.events is not None:
+            write_chrome_trace(trace_path, everyone)
+
+
+def print_phase_table(everyone, out=sys.stdout):
+    """Print the time each process spent in each phase, and a summary.
+
+    Parameters:
+        everyone (list): for each process, a tuple of its host name, its
+            total time, its dictionary of time per phase and its intervals
+        out (file): where to print the table
+    """
+    names = list(PHASES) + sorted(set().union(*[t for h, w, t, e in everyone])
+                                  - set(PHASES))
+    print("\nTime in each phase (sec)", file=out)
+    print("{:>5} {:>12} ".format("rank", "host")
+          + "".join("{:>10}".format(n) for n in names + ["other", "total"]),
+          file=out)
+    for rank, (host, wall, totals, events) in enumerate(everyone):
+        times = [totals.get(n, 0.0) for n in names]
+        print("{:5d} {:>12.12} ".format(rank, host)
+              + "".join("{:10.3f}".format(t)
+                        for t in times + [wall - sum(times), wall]),
+              file=out)
+
+    # the imbalance is over the processes that did some real work, since a
+    # master process may do none or next to none
+    most = max(totals["compute"] for h, w, totals, e in everyone)
+    computes = [totals["compute"] for h, w, totals, e in everyone
+                if totals["compute"] > 0.01 * most]
+    walls = sum(wall for h, wall, t, e in everyone)
+    communication = sum(totals["send"] + totals["recv_wait"]
+                        for h, w, totals, e in everyone)
+    idle = sum(totals["idle"] for h, w, totals, e in everyone)
+    if computes:
+        print("Compute imbalance (max/mean over {} processes): {:.2f}".format(
+              len(computes), max(computes) / (sum(computes) / len(computes))),
+              file=out)
+    if walls > 0:
+        print("Communication fraction: {:.1%}   idle fraction: {:.1%}".format(
+              communication / walls, idle / walls), file=out)
+
+
+def write_chrome_trace(path, everyone):
+    """Write every process's intervals as a Chrome trace timeline.
+
+    Each process is shown as its own row, named by rank and host.
+
+    Parameters:
+        path (str): name of the JSON file to write
+        everyone (list): as for print_phase_table
+    """
+    trace = []
+    for rank, (host, wall, totals, events) in enumerate(everyone):
+        trace.append({"name": "process_name", "ph": "M", "pid": rank,
+                      "args": {"name": "rank {} ({})".format(rank, host)}})
+        for name, begin, length in events:
+            trace.append({"name": name, "cat": name, "ph": "X", "pid": rank,
+                          "tid": 0, "ts": begin * 1e6, "dur": length * 1e6})
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)